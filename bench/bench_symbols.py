@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scaling of the visit of very large function bodies. A function with n
+statements and n/4 arguments is generated, visited and merged with a
+second visit, for increasing n. The time per statement must stay
+about constant: the symbol tables of PXFunction are indexed.
+
+    python bench/bench_symbols.py [-r repeat] [n ...]
+"""
+
+import ast
+import logging
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import py2pxd_ as PX
+
+def makeSource(n, nargs):
+    """
+    Source of a function of n statements with nargs arguments
+    """
+    args = ', '.join('a%d=0' % i for i in range(nargs))
+    body = []
+    for i in range(n):
+        body.append('    v%d = a%d + %d' % (i % 200, i % nargs, i))
+        body.append('    a%d = 1.0' % (i % nargs))
+    return 'def f(%s):\n%s\n    return 0\n' % (args, '\n'.join(body))
+
+def timeVisit(tree, repeat):
+    """
+    Best time of repeat visits and merges of tree
+    """
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        m0 = PX.PXModule()
+        m0.visit(tree)
+        m1 = PX.PXModule()
+        m1.visit(tree)
+        m0.merge(m1)
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+def main(opt_args=None):
+    parser = optparse.OptionParser(usage='%prog [options] [n ...]')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int', default=3,
+                      help='number of runs, the best one is kept')
+    opts, args = parser.parse_args(opt_args)
+    sizes = [int(a) for a in args] or [1000, 2000, 4000, 8000]
+
+    print('%8s %10s %14s' % ('n', 'time (s)', 'us/statement'))
+    for n in sizes:
+        tree = ast.parse(makeSource(n, max(1, n // 4)))
+        t = timeVisit(tree, opts.repeat)
+        print('%8d %10.3f %14.1f' % (n, t, 1.0e6 * t / n))
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    main()
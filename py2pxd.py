@@ -23,42 +23,14 @@ import py2pxd_ as PX
 
 LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.function")
 
-def xeqOneFile(fin, fout):
+def updateFile(ftmp, fout, lh=0):
     """
-    Treat one python file. Manages backup and update.
+    Replace fout with ftmp if they differ, past the first lh bytes (header).
+    The previous fout is kept as a backup.
     """
     fbck = '.'.join([fout, 'bak'])        # Backup
-    ftmp = '.'.join([fout, 'new'])        # New file
-
-    # ---  Build parse tree
-    src = ''.join(open(fin, 'rt').readlines())
-    tree = ast.parse(src)
-
-    # ---  Transfer parse tree
-    #LOGGER.setLevel(logging.DEBUG)
-    m0 = PX.PXModule()
-    m0.visit(tree)
-
-    # ---  Read structure from file
-    m1 = PX.PXModule()
-    try:
-        with open(fout, 'rt') as fi:
-            m1.read(fi)
-    except IOError:
-        pass
-
-    # ---  Merge structures
-    m0.merge(m1)
-    #return
-
-    # ---  Write to new file
-    with open(ftmp, 'wt') as fo:
-        m0.write(fo)
-
-    # ---  Manage backup and update
     if os.path.isfile(ftmp):
         if os.path.isfile(fout):
-            lh = len(PX.HEADER)
             tmp_fic = open(ftmp, 'rb')
             out_fic = open(fout, 'rb')
             tmp_md5 = HashlibMD5(tmp_fic.read()[lh:])
@@ -76,10 +48,198 @@ def xeqOneFile(fin, fout):
             os.renames(ftmp, fout)
             LOGGER.info(' --> Creating %s', fout)
 
+def xeqOneFile(fin, fout, formats=('pxd',), cache=None, opts=None, prof=None, report=None, incr=False):
+    """
+    Treat one python file. Manages backup and update.
+    The model is built once and written in all the formats; fout
+    is the pxd file, the other outputs are named after it.
+    If cache, a PXCache, is given, the outputs are looked up in and
+    stored to the cache. opts are the PXOptions of the generation.
+    If prof, a PXProfile, is given, only the hot functions are generated
+    and, if report is a stream, the hot untyped ones are reported.
+    If incr, the unchanged definitions are taken from the item cache
+    of fin, in its __pycache__.
+    """
+    if prof and not prof.isHot(fin):
+        LOGGER.info(' --> Not hot, skipping %s', fin)
+        return
+
+    # ---  Read the source and the existing pxd
+    with open(fin, 'rt') as fi:
+        src = fi.read()
+    try:
+        with open(fout, 'rt') as fi:
+            pxd = fi.read()
+    except IOError:
+        pxd = None
+    tree = ast.parse(src)
+
+    # ---  Look up the outputs in the cache
+    outs = {}
+    if cache and not report:
+        prj = []
+        for f in PX.PXReferences.projectFiles(opts.project if opts else []):
+            with open(f, 'rb') as fi:
+                prj.append(HashlibMD5(fi.read()).hexdigest())
+        include = opts.include if opts else []
+        for f in PX.PXCimports(fin, include).files(tree):
+            with open(f, 'rb') as fi:
+                prj.append(HashlibMD5(fi.read()).hexdigest())
+        # ---  The paths are covered by the digests of their files
+        kopts = PX.PXOptions(**dict(vars(opts), project=[], include=[])) if opts else None
+        key = cache.key(src, pxd, (sorted(formats), kopts, prj, prof))
+        for fmt in formats:
+            outs[fmt] = cache.get(key, fmt)
+            if outs[fmt] is None: break
+        else:
+            LOGGER.info(' --> Cached %s', fout)
+    if not outs or None in outs.values():
+        # ---  Build the model from the source and merge with pxd
+        icache = PX.PXItemCache(PX.PXItemCache.pathFor(fin)) if incr else None
+        m0 = PX.buildModule(src, tree=tree, opts=opts, path=fin, cache=icache)
+        if prof:
+            prof.allocations(m0, fin)
+            hot = prof.select(m0, fin)
+        PX.mergeModule(m0, pxd)
+        if icache is not None:
+            icache.save()
+            LOGGER.info('%s', icache)
+        if prof and report:
+            prof.report(hot, report)
+        # ---  Render
+        for fmt in formats:
+            outs[fmt] = PX.renderModule(m0, fmt)
+            if cache and not report: cache.put(key, fmt, outs[fmt])
+
+    for fmt in formats:
+        writer = PX.WRITERS[fmt]
+        fdst = fout
+        if fmt != 'pxd':
+            fdst = os.path.splitext(fout)[0] + writer.ext
+        ftmp = '.'.join([fdst, 'new'])        # New file
+
+        # ---  Write to new file
+        with open(ftmp, 'wt') as fo:
+            fo.write(outs[fmt])
+
+        # ---  Manage backup and update
+        updateFile(ftmp, fdst, len(writer.header))
+
+
+def xeqAnnotate(fin, fout, fann=None, minScore=1, apply=False, fo=sys.stdout):
+    """
+    Map the cython annotations of fin (html or C file fann, or run cython
+    if None) to the untyped names, and report the proposed types. If
+    apply, the proposed types are merged in fout.
+    """
+    ann = PX.PXAnnotation()
+    if fann:
+        ann.read(fann, fin)
+    else:
+        ann.run(fin)
+
+    with open(fin, 'rt') as fi:
+        m0 = PX.buildModule(fi.read(), path=fin)
+    try:
+        with open(fout, 'rt') as fi:
+            PX.mergeModule(m0, fi)
+    except IOError:
+        pass
+
+    res = ann.analyse(m0, minScore)
+    ann.report(res, fo)
+    if apply:
+        ann.apply(res)
+        ftmp = '.'.join([fout, 'new'])
+        with open(ftmp, 'wt') as fo:
+            PX.renderModule(m0, 'pxd', fo)
+        updateFile(ftmp, fout, len(PX.HEADER))
+
+def mainAnnotate(opt_args):
+    usage  = '%s annotate [options]' % __package__
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-v", "--verbose", dest="vrb", default=False, action="store_true",
+                      help="increase verbosity")
+    parser.add_option("-i", "--fi", "--input", dest="inp", default=None,
+                      help="cythonized python file", metavar="input_path")
+    parser.add_option("-o", "--fo", "--output", dest="out", default=None,
+                      help="pxd file. Defaults to input_path.pxd", metavar="output_path")
+    parser.add_option("-a", "--annotation", dest="ann", default=None,
+                      help="html from cython -a, or generated C file. Defaults to running cython", metavar="path")
+    parser.add_option("--min-score", dest="score", default=1, type="int",
+                      help="minimal score of the lines", metavar="score")
+    parser.add_option("--apply", dest="apply", default=False, action="store_true",
+                      help="merge the proposed types in the pxd file")
+
+    options, _ = parser.parse_args(opt_args)
+    if options.vrb:
+        LOGGER.setLevel(logging.DEBUG)
+    if not options.inp:
+        parser.print_help()
+        return
+    if not options.out:
+        options.out = os.path.splitext(options.inp)[0] + '.pxd'
+
+    LOGGER.info('%s annotations --> %s', options.inp, options.out)
+    try:
+        xeqAnnotate(options.inp, options.out, options.ann, options.score, options.apply)
+    except RuntimeError as e:
+        LOGGER.error('%s', str(e))
+
+def xeqBench(fin, fpxd, fbench, repeat=5, fo=sys.stdout):
+    """
+    Time the benchmark fbench with fin, pure and compiled with fpxd,
+    and report the speedups.
+    """
+    bench = PX.PXBench(fin, fpxd, fbench, repeat)
+    res = bench.run()
+    with open(fin, 'rt') as fi:
+        m0 = PX.buildModule(fi.read(), path=fin)
+    try:
+        with open(fpxd, 'rt') as fi:
+            PX.mergeModule(m0, fi)
+    except IOError:
+        pass
+    bench.report(res, m0, fo)
+
+def mainBench(opt_args):
+    usage  = '%s bench [options]' % __package__
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-v", "--verbose", dest="vrb", default=False, action="store_true",
+                      help="increase verbosity")
+    parser.add_option("-i", "--fi", "--input", dest="inp", default=None,
+                      help="python file to benchmark", metavar="input_path")
+    parser.add_option("-o", "--fo", "--output", dest="out", default=None,
+                      help="pxd file. Defaults to input_path.pxd", metavar="output_path")
+    parser.add_option("-b", "--bench", dest="bench", default=None,
+                      help="python file with the bench_<name>(mod) functions", metavar="bench_path")
+    parser.add_option("-r", "--repeat", dest="repeat", default=5, type="int",
+                      help="number of timing repetitions", metavar="n")
+
+    options, _ = parser.parse_args(opt_args)
+    if options.vrb:
+        LOGGER.setLevel(logging.DEBUG)
+    if not options.inp or not options.bench:
+        parser.print_help()
+        return
+    if not options.out:
+        options.out = os.path.splitext(options.inp)[0] + '.pxd'
+
+    LOGGER.info('%s bench %s with %s', options.inp, options.bench, options.out)
+    try:
+        xeqBench(options.inp, options.out, options.bench, options.repeat)
+    except RuntimeError as e:
+        LOGGER.error('%s', str(e))
 
 def main(opt_args=None):
     LOGGER.info('%s %s', PX.__package__, PX.__version__)
 
+    if not opt_args: opt_args = sys.argv[1:]
+    if opt_args and opt_args[0] == 'annotate':
+        return mainAnnotate(opt_args[1:])
+    if opt_args and opt_args[0] == 'bench':
+        return mainBench(opt_args[1:])
+
     # ---  Define options
     usage  = '%s [options]' % __package__
     parser = optparse.OptionParser(usage)
@@ -89,9 +249,39 @@ def main(opt_args=None):
                       help="input file to cythonize", metavar="input_path")
     parser.add_option("-o", "--fo", "--output", dest="out", default=None,
                       help="pxd output file. Defaults to input_path.pxd", metavar="output_path")
+    parser.add_option("-f", "--format", dest="fmt", default="pxd",
+                      help="comma separated list of output formats (%s)" % ', '.join(sorted(PX.WRITERS)),
+                      metavar="formats")
+    parser.add_option("--cache-dir", dest="cache", default=None,
+                      help="directory of the shared output cache", metavar="cache_path")
+    parser.add_option("--cache-size", dest="cache_size", default=None, type="float",
+                      help="size limit of the cache, in MB", metavar="size")
+    parser.add_option("--incremental", dest="incr", default=False, action="store_true",
+                      help="visit only the changed definitions, the others are cached in __pycache__")
+    parser.add_option("--narrow", dest="narrow", default=False, action="store_true",
+                      help="type the literals with the narrowest type (int, float)")
+    parser.add_option("--cdef", dest="cdef", default=False, action="store_true",
+                      help="use cdef for the functions and methods not used from python")
+    parser.add_option("-p", "--project", dest="project", default=[], action="append",
+                      help="file or directory of the project, searched for references", metavar="path")
+    parser.add_option("--profile", dest="profile", default=None,
+                      help="cProfile/pstats file: generate only the hot functions", metavar="stats_path")
+    parser.add_option("--hot", dest="hot", default="0",
+                      help="cumulative time threshold of the hot functions, in seconds, or in percent of the total if followed by %%", metavar="threshold")
+    parser.add_option("--hot-report", dest="report", default=None,
+                      help="report of the hot untyped functions ('-' for stdout)", metavar="report_path")
+    parser.add_option("--final", dest="final", default=False, action="store_true",
+                      help="make final the classes without subclasses in the module or the project")
+    parser.add_option("--not-final", dest="nonFinal", default=[], action="append",
+                      help="comma separated classes that must not be made final (with --final)", metavar="classes")
+    parser.add_option("-I", "--include", dest="include", default=[], action="append",
+                      help="directory searched for the pxd of the cimported modules", metavar="path")
+    parser.add_option("--structs", dest="structs", default=False, action="store_true",
+                      help="add a ctypedef struct for the numeric NamedTuple and dataclass records")
+    parser.add_option("--freelist", dest="freelist", default=8, type="int",
+                      help="freelist size of the small classes allocated in loops, 0 for none", metavar="n")
 
     # ---  Parse options
-    if not opt_args: opt_args = sys.argv[1:]
     options, _ = parser.parse_args(opt_args)
     if options.vrb:
         LOGGER.setLevel(logging.DEBUG)
@@ -100,10 +290,41 @@ def main(opt_args=None):
         return
     if not options.out:
         options.out = os.path.splitext(options.inp)[0] + '.pxd'
+    formats = [f.strip() for f in options.fmt.split(',') if f.strip()]
+    for f in formats:
+        if f not in PX.WRITERS:
+            parser.error('unknown format: %s' % f)
+
+    opts = PX.PXOptions(narrow=options.narrow,
+                        cdef=options.cdef,
+                        project=options.project,
+                        final=options.final,
+                        nonFinal=[c.strip() for l in options.nonFinal for c in l.split(',')],
+                        structs=options.structs,
+                        freelist=options.freelist,
+                        include=options.include)
+    cache = None
+    if options.cache:
+        size = options.cache_size
+        if size is not None: size = int(size * 1024 * 1024)
+        cache = PX.PXCache(options.cache, size)
+
+    prof = None
+    if options.profile:
+        prof = PX.PXProfile(options.profile, options.hot)
+    report = None
+    if options.report == '-':
+        report = sys.stdout
+    elif options.report:
+        report = open(options.report, 'wt')
 
     # --- Execute
     LOGGER.info('%s --> %s', options.inp, options.out)
-    xeqOneFile(options.inp, options.out)
+    xeqOneFile(options.inp, options.out, formats, cache, opts, prof, report, options.incr)
+    if report and report is not sys.stdout:
+        report.close()
+    if cache:
+        LOGGER.info('%s', cache)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from .pxoptions  import PXOptions
 from .pxreader   import PXReader
 from .pxvariable import PXVariable
 from .pxfunction import PXFunction
 from .pxclass    import PXClass
 from .pxmodule   import PXModule, __version__, HEADER
+from .pxrefs     import PXReferences
+from .pxcimport  import PXCimports
+from .pxwriter   import PXWriter, PXDWriter, PYIWriter, WRITERS, registerWriter
+from .pxapi      import buildModule, readModule, mergeModule, renderModule, generate
+from .pxcache    import PXCache
+from .pxitems    import PXItemCache
+from .pxprofile  import PXProfile
+from .pxannotate import PXAnnotation
+from .pxbench    import PXBench
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Feedback from the cython annotations. The lines with a heavy Python
+interaction, as reported by "cython -a" (html) or as found in the
+generated C code, are mapped back to the untyped arguments and locals
+of the functions. Types are proposed for them, and can be merged in
+the model.
+"""
+
+import ast
+import html.parser
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from .           import pxtype
+from .pxvariable import PXVariable
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.annotate")
+
+class PXHtmlScores(html.parser.HTMLParser):
+    """
+    Scores of the lines from the html of cython -a:
+    <pre class="cython line score-N" ...>+<span>LL</span>: code</pre>
+    """
+    def __init__(self):
+        super(PXHtmlScores, self).__init__()
+        self.scores = {}
+        self.score  = None
+        self.text   = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'pre': return
+        cls = (dict(attrs).get('class') or '').split()
+        if 'line' not in cls: return
+        for c in cls:
+            if c.startswith('score-'):
+                self.score = int(c[6:])
+                self.text  = []
+
+    def handle_data(self, data):
+        if self.score is not None:
+            self.text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag != 'pre' or self.score is None: return
+        m = re.match(r'\W*(\d+):', ''.join(self.text))
+        if m:
+            self.scores[int(m.group(1))] = self.score
+        self.score = None
+
+
+class PXAnnotation(object):
+    def __init__(self):
+        self.scores = {}        # {line: score}
+
+    #--------------------
+    #   Readers
+    #--------------------
+    def readHtml(self, fi):
+        p = PXHtmlScores()
+        p.feed(fi.read())
+        p.close()
+        self.scores = p.scores
+
+    def readC(self, fi, fname):
+        """
+        Scores from the C code: the number of calls to the Python C-API
+        generated for each line of fname.
+        """
+        marker = re.compile(r'/\* "(.*?)":(\d+)')
+        pyapi  = re.compile(r'\b(?:__Pyx_\w+|Py[A-Z]\w*_\w+)\s*\(')
+        bname = os.path.basename(fname)
+        line = None
+        self.scores = {}
+        for l in fi:
+            m = marker.search(l)
+            if m:
+                line = int(m.group(2)) if os.path.basename(m.group(1)) == bname else None
+                continue
+            if line is not None:
+                n = len(pyapi.findall(l))
+                if n: self.scores[line] = self.scores.get(line, 0) + n
+
+    def read(self, path, fname):
+        LOGGER.debug('PXAnnotation.read: %s', path)
+        with open(path, 'rt') as fi:
+            if os.path.splitext(path)[1] == '.c':
+                self.readC(fi, fname)
+            else:
+                self.readHtml(fi)
+
+    def run(self, fname):
+        """
+        Annotate fname with the locally installed cython.
+        """
+        LOGGER.debug('PXAnnotation.run: %s', fname)
+        with tempfile.TemporaryDirectory(prefix='py2pxd-') as tmpdir:
+            cfile = os.path.join(tmpdir, os.path.splitext(os.path.basename(fname))[0] + '.c')
+            cmd = [sys.executable, '-m', 'cython', '-3', '-a', fname, '-o', cfile]
+            r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+            if r.returncode != 0:
+                raise RuntimeError('cython failed:\n%s' % r.stdout)
+            self.read(os.path.splitext(cfile)[0] + '.html', fname)
+
+    #--------------------
+    #   Analysis
+    #--------------------
+    @staticmethod
+    def __numType(node, f):
+        """
+        Numeric type of the expression node, in the function f, or None
+        """
+        if isinstance(node, ast.Constant) and not isinstance(node.value, str):
+            t = PXVariable.resolveType(type(node.value))
+        elif isinstance(node, ast.Name):
+            v = f.args.get(node.id) or f.locls.get(node.id)
+            t = v.type if v else None
+        elif isinstance(node, ast.BinOp):
+            tl = PXAnnotation.__numType(node.left, f)
+            tr = PXAnnotation.__numType(node.right, f)
+            t = pxtype.join(tl, tr) if tl and tr else None
+            if t and isinstance(node.op, ast.Div) and pxtype.isInteger(t): t = 'double'
+        else:
+            t = None
+        return t if t and pxtype.isNumeric(t) else None
+
+    def propose(self, f):
+        """
+        Types proposed for the untyped arguments and locals of f, from
+        their assignments and range() loops in f: {name: type}. A name
+        also assigned a value of unknown type is an object, and is not
+        proposed.
+        """
+        props = {}
+        propose = self.__proposer(f, props, strict=True)
+        for n in ast.walk(f.node):
+            # ---  for i in range(...) and range(n)
+            if isinstance(n, ast.For) and isinstance(n.iter, ast.Call) and \
+               isinstance(n.iter.func, ast.Name) and n.iter.func.id == 'range':
+                if isinstance(n.target, ast.Name):
+                    propose(n.target.id, 'Py_ssize_t')
+                for a in n.iter.args:
+                    if isinstance(a, ast.Name): propose(a.id, 'Py_ssize_t')
+            elif isinstance(n, (ast.For, ast.AsyncFor)):
+                for e in ast.walk(n.target):
+                    if isinstance(e, ast.Name) and isinstance(e.ctx, ast.Store): propose(e.id, None)
+            # ---  x = expr, x += expr
+            elif isinstance(n, (ast.Assign, ast.AugAssign)):
+                tgts = n.targets if isinstance(n, ast.Assign) else [n.target]
+                t = self.__numType(n.value, f)
+                if isinstance(n, ast.AugAssign) and isinstance(n.op, ast.Div): t = 'double'
+                for tgt in tgts:
+                    for e in ast.walk(tgt):
+                        if isinstance(e, ast.Name) and isinstance(e.ctx, ast.Store):
+                            propose(e.id, t if e is tgt else None)
+        return {k: t for k, t in props.items() if t != 'object'}
+
+    def guess(self, f):
+        """
+        Types guessed for the untyped arguments and locals of f, from the
+        arithmetic they take part in: {name: type}. An array operand
+        (NumPy) looks the same, the guesses are only reported.
+        """
+        guesses = {}
+        propose = self.__proposer(f, guesses)
+        for n in ast.walk(f.node):
+            # ---  x op expr
+            if isinstance(n, ast.BinOp) and not isinstance(n.op, (ast.Mod, ast.Add, ast.Mult)):
+                for a, b in ((n.left, n.right), (n.right, n.left)):
+                    if isinstance(a, ast.Name): propose(a.id, self.__numType(b, f))
+            elif isinstance(n, ast.BinOp):
+                # ---  + * % are also str/list operations: only with floats
+                for a, b in ((n.left, n.right), (n.right, n.left)):
+                    t = self.__numType(b, f)
+                    if isinstance(a, ast.Name) and t and pxtype.isFloating(t): propose(a.id, t)
+        return guesses
+
+    @staticmethod
+    def __proposer(f, props, strict=False):
+        """
+        Function adding a type for an untyped name of f to props. If
+        strict, an unknown type (None) makes the name an object.
+        """
+        untyped = lambda n: n in f.locls and f.locls[n].type in pxtype.unknown_types or \
+                            n in f.args  and f.args[n].type  in pxtype.unknown_types
+        def propose(n, t):
+            if not untyped(n): return
+            if strict:
+                props[n] = pxtype.joinStrict(props.get(n, t or 'object'), t or 'object')
+                return
+            if not t: return
+            t = pxtype.join(props.get(n, ''), t)
+            if t: props[n] = t
+        return propose
+
+    def analyse(self, mdl, minScore=1):
+        """
+        For the functions of mdl, find the untyped names used on the lines
+        with a score of at least minScore.
+        Returns a list of (score, function, {name: score}, {name: type},
+        {name: guessed type}) by decreasing score.
+        """
+        LOGGER.debug('PXAnnotation.analyse')
+        untyped = pxtype.unknown_types
+        res = []
+        for f in mdl.functions():
+            if f.node is None: continue
+            lines = range(f.node.lineno, f.node.end_lineno + 1)
+            hot = {l: self.scores[l] for l in lines if self.scores.get(l, 0) >= minScore}
+            if not hot: continue
+            names = {}
+            for n in ast.walk(f.node):
+                if isinstance(n, ast.Name) and getattr(n, 'lineno', None) in hot:
+                    v = f.args.get(n.id) or f.locls.get(n.id)
+                    if v is not None and v.type in untyped:
+                        names[n.id] = names.get(n.id, 0) + hot[n.lineno]
+            if not names: continue
+            props = {k: t for k, t in self.propose(f).items() if k in names}
+            guesses = {k: t for k, t in self.guess(f).items() if k in names and k not in props}
+            res.append((sum(hot.values()), f, names, props, guesses))
+        res.sort(key=lambda r: -r[0])
+        return res
+
+    @staticmethod
+    def apply(res):
+        """
+        Merge the proposed types in the functions, not the guessed ones
+        """
+        for _, f, _, props, _ in res:
+            for k, t in props.items():
+                a = PXVariable()
+                a.doVisit(k, type_name=t)
+                v = f.args.get(k) or f.locls.get(k)
+                v.merge(a)
+
+    @staticmethod
+    def report(res, fo):
+        for score, f, names, props, guesses in res:
+            name = '%s.%s' % (f.clss.name, f.name) if f.clss else f.name
+            fo.write('%6d  %s\n' % (score, name))
+            for k in sorted(names, key=lambda k: -names[k]):
+                t = props.get(k) or (guesses[k] + '?' if k in guesses else '?')
+                fo.write('        %-20s %6d  %s\n' % (k, names[k], t))
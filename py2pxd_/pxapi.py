@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process API, working on source strings, pre-parsed ast and
+pxd text or models. Nothing is written to the file system. The
+visit reads the pxd of the cimported modules, found from the
+source path and the include option, and the files of the project
+option. The functions share no state and can be called
+concurrently from many threads.
+"""
+
+import ast
+import copy
+import io
+import logging
+
+from .pxmodule import PXModule
+from .pxwriter import WRITERS
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.api")
+
+def buildModule(source=None, tree=None, opts=None, path=None, cache=None):
+    """
+    Build a PXModule from python source code or from an already
+    parsed ast.Module, with the PXOptions opts. path is the source
+    file, if any. The tree is not modified.
+    cache is a PXItemCache of the visited definitions, used only
+    with the source. It must not be shared by concurrent calls.
+    """
+    LOGGER.debug('buildModule')
+    if tree is None:
+        tree = ast.parse(source)
+    mdl = PXModule(opts, path, source, cache)
+    mdl.visit(tree)
+    return mdl
+
+def readModule(pxd):
+    """
+    Build a PXModule from pxd text or from a text stream.
+    """
+    LOGGER.debug('readModule')
+    if isinstance(pxd, str):
+        pxd = io.StringIO(pxd)
+    mdl = PXModule()
+    mdl.read(pxd)
+    return mdl
+
+def mergeModule(mdl, pxd):
+    """
+    Merge mdl with pxd, a PXModule, pxd text or a text stream.
+    A PXModule is copied first, so it can be shared by concurrent
+    calls. With an item cache, the merged items are cached too (see
+    PXModule.mergeText).
+    Returns mdl.
+    """
+    LOGGER.debug('mergeModule')
+    if pxd is None:
+        return mdl
+    if isinstance(pxd, PXModule):
+        mdl.merge(copy.deepcopy(pxd))
+    elif mdl.cache is not None:
+        mdl.mergeText(pxd if isinstance(pxd, str) else pxd.read())
+    else:
+        mdl.merge(readModule(pxd))
+    return mdl
+
+def renderModule(mdl, fmt='pxd', fo=None):
+    """
+    Render mdl in the format fmt. If fo is None, the result is
+    returned as a string, otherwise it is written to fo and fo is
+    returned.
+    """
+    LOGGER.debug('renderModule: %s', fmt)
+    writer = WRITERS[fmt]()
+    if fo is None:
+        fo = io.StringIO()
+        writer.write(mdl, fo)
+        return fo.getvalue()
+    writer.write(mdl, fo)
+    return fo
+
+def generate(source=None, tree=None, pxd=None, fmt='pxd', fo=None, opts=None, path=None):
+    """
+    Build, merge and render in one call. See buildModule, mergeModule
+    and renderModule for the arguments.
+    """
+    mdl = buildModule(source=source, tree=tree, opts=opts, path=path)
+    mergeModule(mdl, pxd)
+    return renderModule(mdl, fmt=fmt, fo=fo)
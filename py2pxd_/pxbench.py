@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Speedup of the compiled module against the pure python one.
+
+The benchmark is a python file with functions bench_<name>(mod), each
+exercising the function, or method, <name> of the module mod. Every
+benchmark is timed with the pure python module and with the module
+compiled by cython, with its pxd, in a temporary build directory.
+"""
+
+import importlib.machinery
+import importlib.util
+import glob
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from . import pxtype
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.bench")
+
+class PXBench(object):
+    def __init__(self, fin, fpxd=None, fbench=None, repeat=5):
+        self.fin    = fin
+        self.fpxd   = fpxd if fpxd else os.path.splitext(fin)[0] + '.pxd'
+        self.fbench = fbench
+        self.repeat = repeat
+        self.name   = os.path.splitext(os.path.basename(fin))[0]
+
+    @staticmethod
+    def load(name, path):
+        """
+        Load the module name from path, a .py or an extension module,
+        without registering it in sys.modules.
+        """
+        if os.path.splitext(path)[1] == '.py':
+            loader = importlib.machinery.SourceFileLoader(name, path)
+        else:
+            loader = importlib.machinery.ExtensionFileLoader(name, path)
+        spec = importlib.util.spec_from_file_location(name, path, loader=loader)
+        mod = importlib.util.module_from_spec(spec)
+        dname = os.path.dirname(os.path.abspath(path))
+        sys.path.insert(0, dname)
+        try:
+            loader.exec_module(mod)
+        finally:
+            sys.path.remove(dname)
+        return mod
+
+    def build(self, tmpdir):
+        """
+        Compile the module, with its pxd, in tmpdir.
+        Returns the path of the extension module.
+        """
+        LOGGER.debug('PXBench.build: %s in %s', self.fin, tmpdir)
+        src = os.path.join(tmpdir, self.name + '.py')
+        shutil.copy(self.fin, src)
+        if os.path.isfile(self.fpxd):
+            shutil.copy(self.fpxd, os.path.join(tmpdir, self.name + '.pxd'))
+        cmd = [sys.executable, '-m', 'Cython.Build.Cythonize', '-i', '-3', '-q', src]
+        r = subprocess.run(cmd, cwd=tmpdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                           universal_newlines=True)
+        if r.returncode != 0:
+            raise RuntimeError('cythonize failed:\n%s' % r.stdout)
+        exts = importlib.machinery.EXTENSION_SUFFIXES
+        for f in glob.glob(os.path.join(tmpdir, self.name + '.*')):
+            if any(f.endswith(e) for e in exts): return f
+        raise RuntimeError('cythonize produced no extension module for %s' % self.name)
+
+    def benchmarks(self):
+        """
+        The benchmarks, as {name: function}
+        """
+        bench = self.load('py2pxd_bench_%s' % self.name, self.fbench)
+        return {k[6:]: getattr(bench, k) for k in sorted(dir(bench))
+                if k.startswith('bench_') and callable(getattr(bench, k))}
+
+    def time(self, fn, mod):
+        """
+        Best time of one call of fn(mod)
+        """
+        t = timeit.Timer(lambda: fn(mod))
+        n, _ = t.autorange()
+        return min(t.repeat(repeat=self.repeat, number=n)) / n
+
+    def run(self):
+        """
+        Returns [(name, pure time, compiled time)]
+        """
+        benchs = self.benchmarks()
+        pure = self.load(self.name, self.fin)
+        with tempfile.TemporaryDirectory(prefix='py2pxd-') as tmpdir:
+            comp = self.load(self.name, self.build(tmpdir))
+            res = []
+            for k, fn in benchs.items():
+                LOGGER.debug('PXBench.run: %s', k)
+                res.append((k, self.time(fn, pure), self.time(fn, comp)))
+        return res
+
+    @staticmethod
+    def report(res, mdl, fo):
+        """
+        Write the speedups. For the slower functions, the untyped
+        arguments and return types of the model mdl are listed.
+        """
+        funcs = {}
+        for f in mdl.functions() if mdl else []:
+            funcs[f.name] = f
+            if f.clss: funcs['%s_%s' % (f.clss.name, f.name)] = f
+        fo.write('%-32s %12s %12s %9s\n' % ('function', 'pure (s)', 'compiled (s)', 'speedup'))
+        for k, tp, tc in res:
+            speedup = tp / tc if tc > 0.0 else float('inf')
+            flag = ''
+            if speedup < 1.0:
+                flag = '  SLOWER'
+                f = funcs.get(k)
+                if f:
+                    objs = [a.name for a in f.args.values() if a.type in pxtype.unknown_types]
+                    if f.type in pxtype.unknown_types: objs.append('return')
+                    if objs: flag += ' (object: %s)' % ', '.join(objs)
+            fo.write('%-32s %12.3e %12.3e %8.2fx%s\n' % (k, tp, tc, speedup, flag))
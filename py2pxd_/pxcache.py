@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content addressed cache of the generated outputs. The cache directory
+can be shared by many processes, or machines (NFS): entries are
+written to a temporary file and renamed, and a missing or
+vanishing entry is simply a miss.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+
+from .pxmodule import buildId
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.cache")
+
+class PXCache(object):
+    def __init__(self, path, maxSize=None):
+        """
+        path is the cache directory, maxSize its size limit in bytes.
+        When the limit is exceeded, the least recently used entries
+        are evicted.
+        """
+        self.path = path
+        self.maxSize = maxSize
+        self.hits   = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicts = 0
+
+    def __str__(self):
+        return 'cache %s: %d hits, %d misses, %d stores, %d evictions' % \
+            (self.path, self.hits, self.misses, self.stores, self.evicts)
+
+    @staticmethod
+    def key(source, pxd, options):
+        """
+        Key for the outputs of source merged with pxd (None if there is
+        no pxd) and generated with options.
+        """
+        h = hashlib.sha256()
+        for s in (buildId(), repr(options), source, pxd):
+            s = '' if s is None else s
+            if isinstance(s, str): s = s.encode('utf-8')
+            h.update(hashlib.sha256(s).digest())
+        if pxd is None: h.update(b'no-pxd')
+        return h.hexdigest()
+
+    def __entry(self, key, fmt):
+        return os.path.join(self.path, key[:2], '%s.%s' % (key, fmt))
+
+    def get(self, key, fmt):
+        """
+        Returns the cached output, or None.
+        """
+        fname = self.__entry(key, fmt)
+        try:
+            with open(fname, 'rt') as fi:
+                data = fi.read()
+        except (IOError, OSError):
+            self.misses += 1
+            LOGGER.debug('PXCache.get: miss %s', fname)
+            return None
+        try:
+            os.utime(fname)     # LRU: touch on use
+        except OSError:
+            pass                # read-only or evicted since: still a hit
+        self.hits += 1
+        LOGGER.debug('PXCache.get: hit %s', fname)
+        return data
+
+    def put(self, key, fmt, data):
+        fname = self.__entry(key, fmt)
+        dname = os.path.dirname(fname)
+        try:
+            os.makedirs(dname, exist_ok=True)
+            fd, ftmp = tempfile.mkstemp(prefix='.tmp-', dir=dname)
+            try:
+                with os.fdopen(fd, 'wt') as fo:
+                    fo.write(data)
+                os.chmod(ftmp, 0o644)   # mkstemp is private to the user
+                os.replace(ftmp, fname)
+            except Exception:
+                os.remove(ftmp)
+                raise
+        except (IOError, OSError) as e:
+            LOGGER.warning('PXCache.put: %s: %s', fname, str(e))
+            return
+        self.stores += 1
+        LOGGER.debug('PXCache.put: %s', fname)
+        if self.maxSize is not None:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries, until the cache size is
+        below maxSize.
+        """
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for f in files:
+                if f[0] == '.': continue
+                fname = os.path.join(root, f)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, fname))
+        size = sum(e[1] for e in entries)
+        entries.sort()
+        for _, sz, fname in entries:
+            if size <= self.maxSize: break
+            try:
+                os.remove(fname)
+                self.evicts += 1
+                LOGGER.debug('PXCache.evict: %s', fname)
+            except OSError:
+                pass        # already evicted by someone else
+            size -= sz
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Resolution of the cimports. The classes a module imports from other
+modules are extension types if they are declared by a 'cdef class' in
+the pxd of their module. The pxd files are searched in the directory
+of the source, at the root of its package and in the include
+directories.
+"""
+
+import ast
+import logging
+import os
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.cimport")
+
+class PXCimports(object):
+    def __init__(self, path=None, include=()):
+        """
+        path is the source file, if any, include the other directories
+        searched for the pxd files.
+        """
+        self.path = path
+        self.dirs = self.searchPath(path, include)
+        self.decls = {}     # cdef classes of the pxd files, by path
+
+    @staticmethod
+    def searchPath(path, include=()):
+        """
+        The directory of path, the parent of its top package, then
+        the include directories.
+        """
+        dirs = []
+        if path:
+            d = os.path.dirname(os.path.abspath(path))
+            dirs.append(d)
+            while os.path.isfile(os.path.join(d, '__init__.py')):
+                d = os.path.dirname(d)
+            if d not in dirs: dirs.append(d)
+        dirs.extend(include)
+        return dirs
+
+    @staticmethod
+    def imports(tree):
+        """
+        The names imported at module level by 'from mod import Cls as
+        alias', as {alias: (level, mod, Cls)}
+        """
+        names = {}
+        for n in tree.body:
+            if not isinstance(n, ast.ImportFrom): continue
+            for a in n.names:
+                if a.name == '*': continue
+                names[a.asname or a.name] = (n.level, n.module or '', a.name)
+        return names
+
+    def find(self, level, mod):
+        """
+        The pxd file of the module mod, relative at level, or None
+        """
+        parts = mod.split('.') if mod else []
+        if level:
+            if not self.path: return None
+            d = os.path.dirname(os.path.abspath(self.path))
+            for _ in range(level-1): d = os.path.dirname(d)
+            dirs = [d]
+        else:
+            dirs = self.dirs
+        for d in dirs:
+            base = os.path.join(d, *parts)
+            for f in (base + '.pxd', os.path.join(base, '__init__.pxd')):
+                if parts and os.path.isfile(f): return f
+            if not parts and os.path.isfile(os.path.join(d, '__init__.pxd')):
+                return os.path.join(d, '__init__.pxd')
+        return None
+
+    def classes(self, fpxd):
+        """
+        The cdef classes declared in the pxd file fpxd
+        """
+        try:
+            return self.decls[fpxd]
+        except KeyError:
+            pass
+        clss = set()
+        try:
+            with open(fpxd, 'rt') as fi:
+                for l in fi:
+                    l = l.strip()
+                    if l[0:11] == 'cdef class ':
+                        clss.add(l[11:].split('(')[0].split(':')[0].strip())
+        except (IOError, UnicodeDecodeError) as e:
+            LOGGER.warning('PXCimports: %s: %s', fpxd, str(e))
+        self.decls[fpxd] = clss
+        return clss
+
+    def files(self, tree):
+        """
+        The pxd files of the modules imported by tree
+        """
+        fs = set()
+        for level, mod, _ in self.imports(tree).values():
+            f = self.find(level, mod)
+            if f: fs.add(f)
+        return sorted(fs)
+
+    def resolve(self, tree, names):
+        """
+        The cimport lines of the names, imported by tree, that are
+        extension types, as {name: line}
+        """
+        imps = self.imports(tree)
+        lines = {}
+        for name in names:
+            try:
+                level, mod, cls = imps[name]
+            except KeyError:
+                continue
+            f = self.find(level, mod)
+            if not f or cls not in self.classes(f): continue
+            l = 'from %s%s cimport %s' % ('.'*level, mod, cls)
+            if name != cls: l += ' as %s' % name
+            LOGGER.debug('PXCimports.resolve: %s', l)
+            lines[name] = l
+        return lines
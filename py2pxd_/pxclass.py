@@ -4,21 +4,34 @@
 import ast
 import logging
 
+from .           import pxtype
+from .pxoptions  import PXOptions
 from .pxreader   import PXReader
 from .pxvariable import PXVariable
 from .pxfunction import PXFunction
 
 LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.class")
 
+# ---  Number of attributes of the small classes, for the freelists
+freelist_max_attrs = 8
+
 class PXClass(ast.NodeVisitor, PXReader):
-    def __init__(self):
+    def __init__(self, opts=None):
         super(PXClass, self).__init__()
+        self.opts = opts if opts else PXOptions()
         self.node = None
         self.name = None
         self.type = None
+        self.final = False
+        self.leaf  = True   # no subclass, in the module or the project
+        self.freelist = 0   # size of the freelist, 0 for none
         self.bases = []
         self.meths = []
+        self.specs = []     # special methods, not written to pxd
         self.attrs = {}
+        self.flds  = []     # annotated fields, in declaration order
+        self.record = None  # 'dataclass' or 'namedtuple'
+        self.deco  = None   # record decorator, as written in the source
 
     def __eq__(self, other):
         return self.name == other.name
@@ -28,6 +41,17 @@ class PXClass(ast.NodeVisitor, PXReader):
         LOGGER.debug('PXClass.merge: %s', self.name)
         self.bases = self.bases + [i for i in other.bases if i not in self.bases]
 
+        # ---  A freelist from the pxd is kept, if possible
+        if other.freelist and self.canFreelist():
+            self.freelist = other.freelist
+        elif other.freelist:
+            LOGGER.warning('PXClass.merge: %s can not have a freelist', self.name)
+        # ---  A final from the pxd is kept, if possible
+        if other.final and self.leaf:
+            self.final = True
+        elif other.final:
+            LOGGER.warning('PXClass.merge: %s can not be final', self.name)
+
         for k in other.attrs:
             self.attrs.setdefault(k, other.attrs[k])
         for k in self.attrs:
@@ -36,13 +60,15 @@ class PXClass(ast.NodeVisitor, PXReader):
             except KeyError:
                 pass
 
-        self.meths = self.meths + [i for i in other.meths if i not in self.meths]
+        names = {m.name for m in self.meths}
+        others = {}
+        for o in other.meths:
+            others.setdefault(o.name, o)
+        self.meths = self.meths + [o for o in other.meths if o.name not in names]
         for meth in self.meths:
-            try:
-                idx = other.meths.index(meth)
-                meth.merge(other.meths[idx])
-            except ValueError:
-                pass
+            o = others.get(meth.name)
+            if o is not None and o is not meth:
+                meth.merge(o)
 
     #--------------------
     #   Python source code parser (ast visitors)
@@ -53,6 +79,67 @@ class PXClass(ast.NodeVisitor, PXReader):
         elif isinstance(node, ast.Name):
             return node.id
 
+    def fields(self):
+        """
+        The attributes: the fields in declaration order, then the others
+        """
+        flds = [self.attrs[k] for k in self.flds if k in self.attrs]
+        return flds + [self.attrs[k] for k in sorted(self.attrs.keys()) if k not in self.flds]
+
+    def isStruct(self):
+        """
+        A record with numeric fields only and no methods
+        """
+        if not self.record or not self.attrs or self.meths or self.specs:
+            return False
+        return all(pxtype.isNumeric(a.type) for a in self.attrs.values())
+
+    def hasDecl(self):
+        """
+        A NamedTuple, a tuple, has no cdef class, only its struct if any
+        """
+        return self.record != 'namedtuple' or (self.opts.structs and self.isStruct())
+
+    def canFreelist(self):
+        """
+        Small classes, without base class and without dynamic attributes
+        (__dict__, setattr, vars), can have a freelist.
+        """
+        if self.record == 'namedtuple': return False
+        if [b for b in self.bases if b != 'object']: return False
+        if len(self.attrs) > freelist_max_attrs: return False
+        for n in ast.walk(self.node) if self.node else []:
+            if isinstance(n, ast.Name) and n.id in ['setattr', 'vars', '__dict__']:
+                return False
+            if isinstance(n, ast.Attribute) and n.attr == '__dict__':
+                return False
+            if isinstance(n, ast.Constant) and n.value == '__dict__':
+                return False
+        return True
+
+    def addAttr(self, a):
+        """
+        Add the attribute a, unified with the assignments already seen
+        """
+        old = self.attrs.get(a.name)
+        if old is None:
+            self.attrs[a.name] = a
+        else:
+            old.type = pxtype.joinStrict(old.type, a.type)
+
+    def recordKind(self, node):
+        """
+        'dataclass' or 'namedtuple' if the class is a record, else None
+        """
+        for d in node.decorator_list:
+            if isinstance(d, ast.Call): d = d.func
+            if self.getOneBaseName(d) in ['dataclass', 'dataclasses.dataclass']:
+                return 'dataclass'
+        for b in self.bases:
+            if b in ['NamedTuple', 'typing.NamedTuple']:
+                return 'namedtuple'
+        return None
+
     def visit_ClassDef(self, node):
         print(ValueError('Nested classes are not yet supported'))
 
@@ -62,10 +149,14 @@ class PXClass(ast.NodeVisitor, PXReader):
         if len(node.name) > 4 and node.name[:2] == '__' and node.name[-2:] == '__':
             isSpecialName = True
 
-        v = PXFunction(self)
+        v = PXFunction(self, self.opts)
         v.doVisit(node)
-        if not isSpecialName: self.meths.append(v)
-        self.attrs.update(v.attrs)
+        if isSpecialName:
+            self.specs.append(v)
+        else:
+            self.meths.append(v)
+        for a in v.attrs.values():
+            self.addAttr(a)
 
     def visit_Assign(self, node):
         """Class attributes"""
@@ -73,6 +164,7 @@ class PXClass(ast.NodeVisitor, PXReader):
         try:
             v = ast.literal_eval(node.value)
             t = type(v)
+            if self.opts.narrow: t = pxtype.narrowest(v) or t
         except Exception as e:
             LOGGER.debug('Exception: %s', str(e))
             t = type(None)
@@ -80,7 +172,30 @@ class PXClass(ast.NodeVisitor, PXReader):
             if tgt.id not in ['__slots__']:
                 a = PXVariable()
                 a.doVisit(tgt.id, type_name=t)
-                self.attrs[a.name] = a
+                self.addAttr(a)
+
+    def visit_AnnAssign(self, node):
+        """Annotated class attributes, the fields of the records"""
+        LOGGER.debug('PXClass.visit_AnnAssign')
+        if not isinstance(node.target, ast.Name): return
+        ann = node.annotation
+        if isinstance(ann, ast.Subscript): ann = ann.value
+        if self.getOneBaseName(ann) in ['ClassVar', 'typing.ClassVar',
+                                        'InitVar', 'dataclasses.InitVar']:
+            return
+        t = PXVariable.annotationType(node.annotation)
+        if t in [None, 'Final']:
+            try:
+                v = ast.literal_eval(node.value)
+                t = type(v)
+                if self.opts.narrow: t = pxtype.narrowest(v) or t
+            except Exception:
+                t = type(None)
+        a = PXVariable()
+        a.doVisit(node.target.id, type_name=t)
+        if node.value is not None: a.val = PXVariable.Status.OK     # has a default
+        if a.name not in self.flds: self.flds.append(a.name)
+        self.addAttr(a)
 
     def doVisit(self, node):
         LOGGER.debug('PXClass.doVisit')
@@ -88,6 +203,11 @@ class PXClass(ast.NodeVisitor, PXReader):
         self.name = self.node.name
         LOGGER.debug('PXClass.doVisit: class %s(...)', self.name)
         self.bases = [self.getOneBaseName(n) for n in node.bases]
+        self.record = self.recordKind(node)
+        for d in node.decorator_list:
+            if self.record == 'dataclass' and \
+               self.getOneBaseName(getattr(d, 'func', d)) in ['dataclass', 'dataclasses.dataclass']:
+                self.deco = ast.unparse(d)
         self.generic_visit(node)
 
     def resolveHierarchy(self, knownClasses):
@@ -97,6 +217,8 @@ class PXClass(ast.NodeVisitor, PXReader):
         childs = []
         for c in knownClasses:
             if self.name in c.bases: childs.append(c)
+        self.leaf  = not childs
+        self.final = self.opts.final and self.leaf
         # ---  Resolve first childrens
         for c in childs:
             c.resolveHierarchy(knownClasses)
@@ -143,12 +265,13 @@ class PXClass(ast.NodeVisitor, PXReader):
         self.read_decl(decl)
         LOGGER.debug('PXClass.read: %s', self.name)
         lcls = {}
-        for l in PXReader.read_line(fi):
+        indents = []
+        for l in PXReader.read_line(fi, indents):
             if l == 'pass':
                 pass
-            elif l[0:5] == 'cdef ':
+            elif PXReader.is_var(l):
                 self.read_attr(l)
-            elif l[0:6] == 'cpdef ':
+            elif PXReader.is_func(l):
                 f = PXFunction(self)
                 f.read(l, lcls)
                 LOGGER.debug('    append method %s', f.name)
@@ -158,22 +281,43 @@ class PXClass(ast.NodeVisitor, PXReader):
                 lcls = PXReader.read_locals(l)
             elif l == '':
                 return
+            elif l[-1:] == ':':
+                PXReader.skip_block(fi, indents[-1])
 
     #--------------------
     #   Writer for pxd file
     #--------------------
+    def write_struct(self, fo, indent=0):
+        """
+        The fields by decreasing size, for a compact layout
+        """
+        fo.write('{indent}ctypedef struct {name}_t:\n'.format(indent=' '*indent, name=self.name))
+        flds = sorted(self.fields(), key=lambda a: -pxtype.sizeOf(a.type))
+        for a in flds:
+            fo.write('{indent}{type:12s} {name}\n'.format(indent=' '*(indent+4), type=a.type, name=a.name))
+
     def write(self, fo, indent=0):
+        if self.opts.structs and self.isStruct():
+            self.write_struct(fo, indent)
+            if self.record == 'namedtuple': return
+            fo.write('\n')
+        if self.record == 'namedtuple':
+            return
         bases = ''
         if self.bases:
             bases = '(%s)' % ', '.join(self.bases)
+        if self.freelist:
+            fo.write('{indent}@cython.freelist({n})\n'.format(indent=' '*indent, n=self.freelist))
+        if self.final:
+            fo.write('{indent}@cython.final\n'.format(indent=' '*indent))
         fmt = '{indent}cdef class {name}{bases}:\n'
         s = fmt.format(indent=' '*indent, name=self.name, bases=bases)
         fo.write(s)
         indent += 4
         if self.attrs or self.meths:
             fmt = '{indent}cdef public {type:12s} {name}\n'
-            for k in sorted(self.attrs.keys()):
-                s = fmt.format(indent=' '*indent, type=self.attrs[k].type, name=self.attrs[k].name)
+            for a in self.fields():
+                s = fmt.format(indent=' '*indent, type=a.type, name=a.name)
                 fo.write(s)
             if self.attrs and self.meths:
                 s = '{indent}#\n'.format(indent=' '*indent)
@@ -2,23 +2,42 @@
 # -*- coding: utf-8 -*-
 
 import ast
+import builtins
 import sys
 import logging
 
-from .pxvariable import PXVariable, default_types
+from .           import pxtype
+from .pxoptions  import PXOptions
+from .pxvariable import PXVariable, default_types, annotation_types
 
 LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.function")
 
+# ---  Nodes that can't raise, by themselves
+safe_nodes = (ast.Return, ast.Assign, ast.AugAssign, ast.Expr, ast.If, ast.While,
+              ast.Pass, ast.Break, ast.Continue,
+              ast.Compare, ast.BoolOp, ast.UnaryOp, ast.IfExp,
+              ast.expr_context, ast.operator, ast.cmpop, ast.boolop, ast.unaryop)
+# ---  Operators that can raise ZeroDivisionError, ...
+raise_ops = (ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.MatMult)
+
 class PXFunction(ast.NodeVisitor):
-    def __init__(self, class_=None):
+    def __init__(self, class_=None, opts=None):
         super(PXFunction, self).__init__()
         self.clss = class_
+        self.opts = opts if opts else PXOptions()
         self.node = None
         self.name = ''
         self.type = ''
-        self.args  = []
+        self.kind = 'cpdef'     # or 'cdef'
+        self.exc  = ''          # exception clause, read from pxd or resolved
+        self.facts = None       # facts of the body for the exception clause
+        self.canCdef = True     # False if must be visible from python
+        self.args  = {}     # ordered, by name
+        self.fused = {}     # fused types of the args: {name: [types]}
         self.attrs = {}
         self.locls = {}
+        self.glbls = set()
+        self.cands = set()  # class names, candidate extension types
 
     def __eq__(self, other):
         return self.name == other.name
@@ -28,27 +47,26 @@ class PXFunction(ast.NodeVisitor):
         LOGGER.debug('PXFunction.merge: %s', self.name)
         LOGGER.debug('    merge type:  %s and %s', self.type, other.type)
         if self.type != other.type:
-            if   self.type in ['']:
-                if other.type not in ['']: self.type = other.type
-            elif self.type in ['None']:
-                if other.type not in ['', 'None']: self.type = other.type
-            elif self.type in ['object']:
-                if other.type not in ['', 'None', 'object']: self.type = other.type
-            else:
+            t = pxtype.join(self.type, other.type)
+            if t is None:
                 self.type = '__conflict__type__: "%s" "%s"' % (self.type, other.type)
+            else:
+                self.type = t
         LOGGER.debug('    merged to %s', self.type)
 
-        #self.args = self.args + [i for i in other.args if i not in self.args]
-        for arg in self.args:
+        # ---  A cdef from the pxd is kept, if possible
+        if self.canCdef and other.kind == 'cdef':
+            self.kind = 'cdef'
+        elif other.kind == 'cdef':
+            LOGGER.warning('PXFunction.merge: %s must be cpdef', self.name)
+
+        for k, arg in self.args.items():
             try:
-                idx = other.args.index(arg)
-                arg.merge(other.args[idx])
-            except ValueError:
+                self.mergeArg(arg, other.args[k], other.fused)
+            except KeyError:
                 LOGGER.info('PXFunction.merge: argument added: %s', arg)
-        for arg in other.args:
-            try:
-                idx = self.args.index(arg)
-            except ValueError:
+        for k, arg in other.args.items():
+            if k not in self.args:
                 LOGGER.info('PXFunction.merge: argument removed: %s', arg)
 
         for k in other.locls:
@@ -59,6 +77,154 @@ class PXFunction(ast.NodeVisitor):
             except KeyError:
                 pass
 
+        # ---  An exception clause from the pxd is kept, if safe
+        if self.node is not None and other.exc == 'noexcept' and self.canRaise():
+            LOGGER.warning('PXFunction.merge: %s can raise, noexcept replaced', self.name)
+        elif self.node is not None and other.exc == 'except -1' and self.canReturnSentinel():
+            LOGGER.warning('PXFunction.merge: %s can return -1, except -1 replaced', self.name)
+        elif other.exc:
+            self.exc = other.exc
+
+    def mergeArg(self, arg, other, fused):
+        """
+        Merge the argument arg with other, fused being the fused types
+        of other. Integer and floating types give a fused type.
+        """
+        t1 = self.fused.get(arg.type, [arg.type])
+        t2 = fused.get(other.type, [other.type])
+        if other.type in fused:
+            new = [t for t in t1 if t not in t2 and t not in pxtype.unknown_types]
+            members = t2 + new if all(pxtype.isNumeric(t) for t in new) else None
+            name = other.type
+        else:
+            members = pxtype.fusedMembers(t1 + t2)
+            name = None
+        if members:
+            LOGGER.debug('PXFunction.mergeArg: %s is fused %s', arg.name, members)
+            arg.type = other.type
+            arg.merge(other)
+            self.setFused(arg, members, name)
+        else:
+            arg.merge(other)
+
+    def isTyped(self, t):
+        """
+        Check if t is a C numeric type, or a fused type of them
+        """
+        return all(pxtype.isNumeric(m) for m in self.fused.get(t, [t]))
+
+    def __facts(self):
+        """
+        The facts of the body needed by the exception clause, from a
+        single walk, kept as they don't depend on the types: (unsafe,
+        names, attrs, sentinel). unsafe if a node can raise whatever the
+        types, names and attrs the variables and self attributes read,
+        sentinel if a return can give -1.
+        """
+        if self.facts is not None: return self.facts
+        unsafe, names, attrs = False, set(), set()
+        body = self.node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant):
+            body = body[1:]     # docstring
+        for stmt in body:
+            for n in ast.walk(stmt):
+                if isinstance(n, (ast.BinOp, ast.AugAssign)):
+                    if isinstance(n.op, raise_ops): unsafe = True
+                elif isinstance(n, safe_nodes):
+                    pass
+                elif isinstance(n, ast.Constant):
+                    if not isinstance(n.value, (bool, int, float)) and n.value is not None: unsafe = True
+                elif isinstance(n, ast.Name):
+                    names.add(n.id)
+                elif isinstance(n, ast.Attribute):
+                    if not isinstance(n.value, ast.Name) or n.value.id != 'self': unsafe = True
+                    attrs.add(n.attr)
+                else:
+                    unsafe = True
+        rets = [n.value for n in ast.walk(self.node) if isinstance(n, ast.Return)]
+        try:
+            sentinel = any(ast.literal_eval(v) == -1 for v in rets if v is not None)
+        except Exception:
+            sentinel = True
+        self.facts = (unsafe, names, attrs, sentinel)
+        return self.facts
+
+    def canRaise(self):
+        """
+        Check if the body can raise: raise or assert, calls, indexing,
+        divisions, attributes not of self and names not of a C type.
+        """
+        if self.node is None: return True
+        unsafe, names, attrs, _ = self.__facts()
+        if unsafe: return True
+        for n in names:
+            if n == 'self' and self.clss: continue
+            v = self.args.get(n) or self.locls.get(n)
+            if not v or not self.isTyped(v.type): return True
+        cattrs = self.clss.attrs if self.clss else {}
+        for n in attrs:
+            a = cattrs.get(n)
+            if not a or not self.isTyped(a.type): return True
+        return False
+
+    def canReturnSentinel(self):
+        """
+        Check if -1 can be returned: not if the type is a bint or if
+        all the returns are literals other than -1.
+        """
+        if self.type == 'bint': return False
+        if self.node is None: return True
+        return self.__facts()[3]
+
+    def returnsValue(self):
+        """
+        Check if the body returns a value, outside of the nested
+        functions and classes
+        """
+        if self.node is None: return False
+        nodes = list(self.node.body)
+        while nodes:
+            n = nodes.pop()
+            if isinstance(n, ast.Return) and n.value is not None: return True
+            if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)): continue
+            nodes.extend(ast.iter_child_nodes(n))
+        return False
+
+    def exceptClause(self):
+        """
+        Exception clause of a C return type: noexcept if the body can't
+        raise, 'except -1' if -1 is never returned, else 'except? -1'.
+        """
+        if self.node is None: return self.exc
+        if not pxtype.isNumeric(self.type): return ''
+        if self.exc: return self.exc
+        if not self.canRaise(): return 'noexcept'
+        return self.raiseClause()
+
+    def raiseClause(self):
+        """
+        Exception clause of a C return type, if the function can raise
+        """
+        if self.type == 'size_t' or self.type.startswith('unsigned '):
+            return ''           # no -1 sentinel, cython default
+        return 'except? -1' if self.canReturnSentinel() else 'except -1'
+
+    def setFused(self, arg, members, name=None):
+        """
+        Give to arg the fused type of members
+        """
+        if not name:
+            # ---  Arguments with the same fused type are specialized
+            #      together: each argument gets its own fused type.
+            used = [a.type for a in self.args.values() if a is not arg]
+            base = name = pxtype.fusedName(members)
+            i = 0
+            while name in used:
+                i += 1
+                name = '%s_%d' % (base, i)
+        self.fused[name] = list(members)
+        arg.type = name
+
     #--------------------
     #   Python source code parser (ast visitors)
     #--------------------
@@ -71,8 +237,26 @@ class PXFunction(ast.NodeVisitor):
         self.node = node
         self.name = self.node.name
         LOGGER.debug('PXFunction.doVisit: def %s(...)', self.name)
+        self.canCdef = self.isCdefable(node)
         self.generic_visit(node)
 
+    @staticmethod
+    def isCdefable(node):
+        """
+        Check if the function body can be compiled as a cdef function:
+        no decorator, no *args or **kwargs, no generator and no closure.
+        """
+        if node.decorator_list: return False
+        args = node.args
+        if args.vararg or args.kwarg or args.kwonlyargs: return False
+        for n in ast.walk(node):
+            if n is node: continue
+            if isinstance(n, (ast.Yield, ast.YieldFrom, ast.Await,
+                              ast.FunctionDef, ast.AsyncFunctionDef,
+                              ast.Lambda, ast.ClassDef, ast.GeneratorExp)):
+                return False
+        return True
+
     def visit_Lambda(self, node):
         LOGGER.debug('PXFunction.visit_Lambda: skip')
         pass
@@ -95,42 +279,100 @@ class PXFunction(ast.NodeVisitor):
         # ---  Itère sur les (args, vals)
         for a, v in zip(args, vals):
             arg = PXVariable()
-            arg.doVisit(a.arg, value=v)
+            arg.doVisit(a.arg, value=v, narrow=self.opts.narrow)
+            t = PXVariable.annotationType(a.annotation) if a.annotation else None
+            if t is None and a.annotation: t = self.__className(a.annotation)
+            if t: arg.type = t
             if arg.name == 'self' and self.clss:
                 arg.type = self.clss.name
-            self.args.append(arg)
+            self.args[arg.name] = arg
 
+    # The visitors below are called for every statement of the body.
+    # They don't log and only create a PXVariable when a type changes.
     def __visit_Attribute(self, node, type_name=None):
-        LOGGER.debug('PXFunction.__visit_Attribute')
         try:
             val = node.value.id
         except Exception:
             val = ''
         if val == 'self':
             att = node.attr
-            a = PXVariable()
-            a.doVisit(att, type_name=type_name)
-            self.attrs[a.name] = a
+            t = PXVariable.resolveType(type_name)
+            a = self.attrs.get(att)
+            if a is None:
+                a = PXVariable()
+                a.doVisit(att, type_name=t)
+                self.attrs[a.name] = a
+            elif a.type != t:
+                a.type = pxtype.joinStrict(a.type, t)
+
+    def __className(self, node):
+        """
+        The class name of node, a Cls annotation or a Cls(...) call,
+        recorded as a candidate extension type. None if node is not
+        a class name.
+        """
+        if isinstance(node, ast.Call): node = node.func
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            try:
+                node = ast.parse(node.value, mode='eval').body
+            except SyntaxError:
+                return None
+        if not isinstance(node, ast.Name): return None
+        name = node.id
+        if pxtype.isKnown(name) or name in annotation_types or hasattr(builtins, name):
+            return None
+        self.cands.add(name)
+        return name
+
+    def __valueType(self, node):
+        """
+        Type of the assigned value node: a literal, or an argument
+        or a local already typed. None if unknown.
+        """
+        try:
+            v = ast.literal_eval(node)
+            t = type(v)
+            if self.opts.narrow: t = pxtype.narrowest(v) or t
+            return t
+        except Exception:
+            pass
+        if isinstance(node, ast.Name) and node.id != 'self':
+            a = self.args.get(node.id) or self.locls.get(node.id)
+            if a is not None and (pxtype.isKnown(a.type) or a.type in self.cands):
+                return a.type
+        if isinstance(node, ast.Call):
+            return self.__className(node)
+        return None
+
+    def visit_Global(self, node):
+        self.glbls.update(node.names)
 
     def __visit_Local(self, node, type_name=None):
-        LOGGER.debug('PXFunction.__visit_Local %s as %s', node.id, type_name)
-        a = PXVariable()
-        a.doVisit(node.id, type_name=type_name)
+        name = node.id
+        if name in self.glbls: return
+        t = PXVariable.resolveType(type_name)
         # ---  Check if an args
-        if a in self.args:
-            idx = self.args.index(a)
-            self.args[idx].merge(a)
+        arg = self.args.get(name)
+        if arg is not None:
+            # ---  A class name only types an untyped argument
+            if t in self.cands and arg.type not in pxtype.unknown_types: return
+            if arg.type != t:
+                a = PXVariable()
+                a.doVisit(name, type_name=t)
+                arg.merge(a)
         # ---  Add to locals
         else:
-            self.locls[a.name] = a
+            a = self.locls.get(name)
+            if a is None or a.type != t:
+                a = PXVariable()
+                a.doVisit(name, type_name=t)
+                self.locls[name] = a
 
     def visit_For(self, node):
-        LOGGER.debug('PXFunction.visit_For')
         try:
             v = ast.literal_eval(node.iter)
             t = type(v)
-        except Exception as e:
-            LOGGER.debug('Exception: %s', str(e))
+        except Exception:
             t = type(None)
         tgt = node.target
         if isinstance(tgt, (ast.Tuple, ast.List)):
@@ -144,14 +386,8 @@ class PXFunction(ast.NodeVisitor):
         ast.NodeVisitor.generic_visit(self, node)
 
     def visit_Assign(self, node):
-        LOGGER.debug('PXFunction.visit_Assign')
-        try:
-            v = ast.literal_eval(node.value)
-            t = type(v)
-        except Exception as e:
-            LOGGER.debug('Exception: %s', str(e))
-            t = type(None)
-        LOGGER.debug('  type is %s', t)
+        t = self.__valueType(node.value)
+        if t is None: t = type(None)
 
         for tgt in node.targets:
             if isinstance(tgt, ast.Attribute):
@@ -165,7 +401,6 @@ class PXFunction(ast.NodeVisitor):
                 self.__visit_Local(tgt, t)
 
     def visit_Return(self, node):
-        LOGGER.debug('PXFunction.visit_Return')
         val = node.value
         try:
             if   sys.version_info[0] <  3 and isinstance(val, ast.Name):
@@ -177,8 +412,7 @@ class PXFunction(ast.NodeVisitor):
                 t = type(val.n)
             else:
                 t = type(None)
-        except Exception as e:
-            LOGGER.debug('Exception: %s', str(e))
+        except Exception:
             t = type(None)
         try:
             self.type = default_types[t]
@@ -189,13 +423,13 @@ class PXFunction(ast.NodeVisitor):
     #   Reader for pxd files
     #--------------------
     def read_args(self, args):
-        self.args = []
+        self.args = {}
         args = args.strip()
         if args:
             for arg in args.split(','):
                 a = PXVariable()
                 a.read_arg(arg)
-                self.args.append(a)
+                self.args[a.name] = a
 
     def read_decl(self, decl):
         try:
@@ -206,11 +440,13 @@ class PXFunction(ast.NodeVisitor):
         self.name = n.strip()
 
     def read(self, decl, lcls=None):
-        assert decl[0:6] == 'cpdef '
+        assert decl[0:6] == 'cpdef ' or decl[0:5] == 'cdef '
         LOGGER.debug('PXFunction.read: %s', decl)
-        n, d = decl[6:].split('(', 1)
+        self.kind, decl = decl.split(' ', 1)
+        n, d = decl.split('(', 1)
         n = n.strip()
-        d = d.strip()[:-1]
+        d, e = d.rsplit(')', 1)
+        self.exc = e.strip()
         self.read_decl(n)
         self.read_args(d)
         self.locls = lcls if lcls else {}
@@ -232,7 +468,7 @@ class PXFunction(ast.NodeVisitor):
             fo.write(s)
 
         args = []
-        for a in self.args:
+        for a in self.args.values():
             arg = ''
             if a.type: arg += '%s ' % a.type
             if a.name: arg += '%s'  % a.name
@@ -242,8 +478,10 @@ class PXFunction(ast.NodeVisitor):
                 else:
                     arg += '=*'
             args.append(arg)
-        fmt = '{indent}cpdef {type:12s} {name:16s}({args})\n'
-        s = fmt.format(indent=' '*indent, type=self.type, name=self.name, args='%s' % ', '.join(args))
+        exc = self.exceptClause()
+        fmt = '{indent}{kind:5s} {type:12s} {name:16s}({args}){exc}\n'
+        s = fmt.format(indent=' '*indent, kind=self.kind, type=self.type, name=self.name, args='%s' % ', '.join(args),
+                       exc=' '+exc if exc else '')
         fo.write(s)
 
 
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental regeneration. The visited top-level definitions of a
+module (classes, functions and enums) are kept by fingerprint of their
+source segment, before the module level resolutions (hierarchy, kinds,
+fused types, ...). An unchanged definition is then not visited again.
+The module level resolutions are always done, so a class affected by
+a change in its hierarchy is resolved again.
+"""
+
+import ast
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from .pxmodule import buildId
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.items")
+
+class PXItemCache(object):
+    def __init__(self, path=None):
+        """
+        The items are kept in memory and, if path is given, pickled
+        to path by save.
+        """
+        self.path = path
+        self.items = {}
+        self.used = set()
+        self.hits   = 0
+        self.misses = 0
+        if path:
+            try:
+                with open(path, 'rb') as fi:
+                    self.items = dict(pickle.load(fi))
+            except Exception as e:
+                LOGGER.debug('PXItemCache: %s not loaded: %s', path, str(e))
+
+    def __str__(self):
+        return 'item cache %s: %d hits, %d misses' % (self.path, self.hits, self.misses)
+
+    @staticmethod
+    def pathFor(fname):
+        """
+        Cache file of the source fname, in its __pycache__
+        """
+        dname, bname = os.path.split(os.path.abspath(fname))
+        return os.path.join(dname, '__pycache__', '%s.py2pxd.pickle' % os.path.splitext(bname)[0])
+
+    @staticmethod
+    def key(segment, node, opts):
+        """
+        Fingerprint of the source segment of node, visited with opts
+        """
+        h = hashlib.sha256()
+        for s in (buildId(), repr(opts), type(node).__name__, segment):
+            h.update(hashlib.sha256(s.encode('utf-8')).digest())
+        return h.hexdigest()
+
+    @staticmethod
+    def __nodes(item):
+        """
+        The (visitor, node) of item and of its methods
+        """
+        yield item, item.node
+        for m in getattr(item, 'specs', []) + getattr(item, 'meths', []):
+            yield m, m.node
+
+    def get(self, key, node):
+        """
+        Returns a copy of the item visited for key, attached to node,
+        with its summary, or None.
+        """
+        try:
+            entry = self.items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        # ---  An entry that can't be restored is a miss
+        try:
+            item, offsets, smry = entry
+            item = pickle.loads(item)
+            smry = pickle.loads(smry)
+            vs = [v for v, _ in self.__nodes(item)]
+            for v in vs:
+                # ---  Attributes of an older build
+                missing = set(vars(type(v)())) - set(vars(v))
+                if missing: raise AttributeError(', '.join(sorted(missing)))
+            vs[0].node = node
+            # ---  Methods are found by name and line offset in the class
+            defs = {}
+            for n in ast.walk(node) if offsets else []:
+                if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    defs.setdefault((n.name, n.lineno - node.lineno), n)
+            for v, off in zip(vs[1:], offsets):
+                v.node = defs.get((v.name, off))
+        except Exception as e:
+            LOGGER.debug('PXItemCache.get: %s not restored: %s', key, str(e))
+            del self.items[key]
+            self.misses += 1
+            return None
+        self.used.add(key)
+        self.hits += 1
+        return item, smry
+
+    def put(self, key, item, smry):
+        """
+        Keep a copy of item, pickled without its ast nodes, and of
+        its summary
+        """
+        nodes = list(self.__nodes(item))
+        offsets = [n.lineno - item.node.lineno if n else None for _, n in nodes[1:]]
+        try:
+            for v, _ in nodes: v.node = None
+            self.items[key] = (pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL), offsets,
+                               pickle.dumps(smry, protocol=pickle.HIGHEST_PROTOCOL))
+        finally:
+            for v, n in nodes: v.node = n
+        self.used.add(key)
+
+    def save(self):
+        """
+        Pickle the items used since the creation to path
+        """
+        if not self.path: return
+        items = {k: v for k, v in self.items.items() if k in self.used}
+        dname = os.path.dirname(self.path)
+        try:
+            os.makedirs(dname, exist_ok=True)
+            fd, ftmp = tempfile.mkstemp(dir=dname, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fo:
+                pickle.dump(items, fo, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(ftmp, self.path)
+        except (IOError, OSError, pickle.PicklingError) as e:
+            LOGGER.warning('PXItemCache.save: %s: %s', self.path, str(e))
@@ -3,17 +3,40 @@
 
 import ast
 import datetime
+import functools
+import hashlib
+import io
 import logging
+import os
 
+from .           import pxtype
+from .pxoptions  import PXOptions
 from .pxreader   import PXReader
+from .pxvariable import PXVariable, default_types
 from .pxfunction import PXFunction
 from .pxclass    import PXClass
 from .pxenum     import PXEnum
+from .pxrefs     import PXReferences
+from .pxcimport  import PXCimports
 
 __version__ = '0.0.3'
 
 LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.module")
 
+@functools.lru_cache(maxsize=None)
+def buildId():
+    """
+    Hash of the package sources, for the cache keys: the version is
+    not bumped by every change.
+    """
+    h = hashlib.sha256(__version__.encode('utf-8'))
+    dname = os.path.dirname(os.path.abspath(__file__))
+    for f in sorted(os.listdir(dname)):
+        if not f.endswith('.py'): continue
+        with open(os.path.join(dname, f), 'rb') as fi:
+            h.update(hashlib.sha256(fi.read()).digest())
+    return h.hexdigest()
+
 HEADER = """\
 # -*- coding: utf-8 -*-
 
@@ -28,28 +51,358 @@ import cython
        datetime.datetime.now().replace(microsecond=0).isoformat(' '))
 
 class PXModule(ast.NodeVisitor, PXReader):
-    def __init__(self):
+    loops = (ast.For, ast.AsyncFor, ast.While,
+             ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+    def __init__(self, opts=None, path=None, source=None, cache=None):
         super(PXModule, self).__init__()
+        self.opts  = opts if opts else PXOptions()
+        self.path  = path           # Source file, if any
+        self.cache = cache          # PXItemCache of the visited items, if any
+        self.lines = source.splitlines() if source and cache is not None else None
         self.imprt = []
+        self.pyimp = []     # imports of the source: (module, name, asname)
+        self.glbls = {}
+        self.cnsts = {}
+        self.fused = {}     # fused types read from pxd
         self.items = []
+        self.__nasgn = {}
+        self.__gdecl = set()
+        self.__obind = set()    # names bound otherwise than by assignment
+        self.__smry  = {}   # summaries of the definitions, by id of the item
+        self.__keys  = {}   # cache keys of the definitions, by id of the item
+        self.__phase = 0    # 0 for the definitions, 1 for the globals
 
     def merge(self, other):
         self.imprt = self.imprt + [i for i in other.imprt if i not in self.imprt]
-        self.items = self.items + [i for i in other.items if i not in self.items]
-        for i in self.items:
+        for k in other.glbls:
+            self.glbls.setdefault(k, other.glbls[k])
+        for k in self.glbls:
             try:
-                idx = other.items.index(i)
-                i.merge(other.items[idx])
-            except ValueError:
+                self.glbls[k].merge(other.glbls[k])
+            except KeyError:
                 pass
+        # ---  Items by name, the first one as for list.index
+        names = {i.name for i in self.items}
+        others = {}
+        for o in other.items:
+            others.setdefault(o.name, o)
+        self.items = self.items + [o for o in other.items if o.name not in names]
+        for i in self.items:
+            o = others.get(i.name)
+            if o is not None and o is not i:
+                i.merge(o)
+        self.resolveExcepts()
+
+    def mergeText(self, pxd):
+        """
+        Merge with the pxd text. With an item cache, an item whose
+        resolved state and pxd segment are unchanged is taken merged
+        from the cache, and its segment is not read.
+        """
+        if self.cache is None:
+            other = PXModule()
+            other.read(io.StringIO(pxd))
+            self.merge(other)
+            return
+        segs = [(self.declName(s), s) for s in self.segments(pxd)]
+        cntxt = ''.join(s for n, s in segs if n is None)   # imports, fused, globals
+        count = {}
+        for n, _ in segs:
+            count[n] = count.get(n, 0) + 1
+        for i in self.items:
+            count[i.name] = count.get(i.name, 0) + 1
+        items = {i.name: i for i in self.items if id(i) in self.__keys}
+        rest, puts = [], []
+        for n, s in segs:
+            i = items.get(n)
+            # ---  Names declared once in the source and in the pxd
+            if i is None or count[n] != 2:
+                rest.append(s)
+                continue
+            key = self.cache.key('\0'.join((self.__fingerprint(i), cntxt, s)), i.node, self.opts)
+            hit = self.cache.get(key, i.node)
+            if hit is None:
+                rest.append(s)
+                puts.append((key, i))
+            else:
+                # ---  In place, for the references to the item
+                i.__dict__.update(hit[0].__dict__)
+                for m in getattr(i, 'meths', []) + getattr(i, 'specs', []):
+                    m.clss = i
+        other = PXModule()
+        other.read(io.StringIO(''.join(rest)))
+        self.merge(other)
+        for key, i in puts:
+            self.cache.put(key, i, None)
+
+    def __fingerprint(self, item):
+        """
+        The visited source of item and its state after the module
+        resolutions, as read by the merge
+        """
+        fo = io.StringIO()
+        fo.write(self.__keys[id(item)])
+        item.write(fo)
+        for m in getattr(item, 'specs', []):
+            m.write(fo)
+        for m in [item] + getattr(item, 'meths', []) + getattr(item, 'specs', []):
+            fo.write(' %s' % getattr(m, 'canCdef', ''))
+        fo.write(' %s' % getattr(item, 'leaf', ''))
+        return fo.getvalue()
+
+    @staticmethod
+    def segments(pxd):
+        """
+        The top-level statements of the pxd text, each with its decorators,
+        comments and indented block
+        """
+        segs, cur, depth, lead = [], [], 0, False
+        for l in pxd.splitlines(True):
+            top = depth == 0 and l[:1] not in ['', ' ', '\t', '\n', '\r']
+            if top and cur and not lead:
+                segs.append(''.join(cur))
+                cur = []
+            if top: lead = l[0] in '@#'
+            cur.append(l)
+            depth += l.count('(') - l.count(')')
+        if cur: segs.append(''.join(cur))
+        return segs
+
+    @staticmethod
+    def declName(seg):
+        """
+        Name of the class, enum or function declared by the segment,
+        None for the other statements
+        """
+        for l in seg.splitlines():
+            if l[:1] in ['', ' ', '\t', '@', '#']: continue
+            l = ' '.join(l.split('#')[0].split())
+            if l[0:11] == 'cdef class ': return l[11:].split('(')[0].split(':')[0].strip()
+            if l[0:10] == 'cdef enum ':  return l[10:].split(':')[0].strip()
+            if PXReader.is_func(l):      return l.split('(')[0].split()[-1]
+            return None
+        return None
 
     #--------------------
     #   Python source code parser (ast visitors)
     #--------------------
     def visit_Module(self, node):
         LOGGER.debug('PXModule.visit_Module')
+        # ---  The definitions first: their global statements are
+        #      needed by the module level assignments
+        self.__phase = 0
         self.generic_visit(node)
-        self.resolveHierarchy()
+        for s in self.__smry.values():
+            self.__gdecl.update(s['glbls'])
+        self.__obind = set(self.__bindings(node))
+        self.__phase = 1
+        self.generic_visit(node)
+        self.resolveCimports(node)
+        # ---  References in the module and in the project
+        refs = PXReferences()
+        for s in self.__smry.values():
+            refs.extrn.update(s['extrn'])
+            refs.bases.update(s['bases'])
+        for n in self.__rest(node):
+            refs.visit(n)
+        if self.opts.project:
+            refs.doVisitProject(self.opts.project, exclude=self.path)
+        self.resolveHierarchy(refs)
+        self.resolveGlobals(refs)
+        self.resolveConstants()
+        self.resolveKinds(refs)
+        self.resolveFused(node)
+        self.resolveFreelists(node)
+        self.resolveExcepts()
+
+    def __inferType(self, node):
+        """
+        Type of a module level expression: literals and arithmetic
+        on literals and on already typed globals.
+        """
+        try:
+            v = ast.literal_eval(node)
+            if self.opts.narrow: return pxtype.narrowest(v) or default_types[type(v)]
+            return default_types[type(v)]
+        except Exception:
+            pass
+        if isinstance(node, ast.Name):
+            try:
+                return self.glbls[node.id].type
+            except KeyError:
+                return default_types[type(None)]
+        if isinstance(node, ast.UnaryOp):
+            t = self.__inferType(node.operand)
+            if isinstance(node.op, ast.Not): return 'bint'
+            if t == 'bint': return 'long'
+            return t if pxtype.isNumeric(t) else default_types[type(None)]
+        if isinstance(node, ast.BinOp):
+            return self.__inferBinOp(node.op,
+                                     self.__inferType(node.left),
+                                     self.__inferType(node.right),
+                                     node.right)
+        return default_types[type(None)]
+
+    @staticmethod
+    def __inferBinOp(op, tl, tr, right=None):
+        tl = 'long' if tl == 'bint' else tl
+        tr = 'long' if tr == 'bint' else tr
+        if not pxtype.isNumeric(tl) or not pxtype.isNumeric(tr):
+            return default_types[type(None)]
+        t = pxtype.join(tl, tr)
+        if isinstance(op, ast.Div):
+            return t if pxtype.isFloating(t) else 'double'
+        if isinstance(op, ast.Pow) and pxtype.isInteger(t):
+            # ---  a negative exponent gives a float
+            try:
+                if ast.literal_eval(right) >= 0: return t
+            except Exception:
+                pass
+            return default_types[type(None)]
+        return t
+
+    def __visit_Global(self, name, type_name, value=PXVariable.Status.Undefined):
+        LOGGER.debug('PXModule.__visit_Global %s as %s', name, type_name)
+        if name[:2] == '__' and name[-2:] == '__': return
+        self.__nasgn[name] = self.__nasgn.get(name, 0) + 1
+        a = PXVariable()
+        a.doVisit(name, type_name=type_name)
+        a.val = value
+        if name in self.__gdecl or name in self.__obind:
+            a.type = default_types[type(None)]
+        # ---  All assignments must agree on the type
+        if name in self.glbls and self.glbls[name].type != a.type:
+            a.type = default_types[type(None)]
+        self.glbls[name] = a
+
+    def visit_Import(self, node):
+        if self.__phase == 0: return
+        for a in node.names:
+            self.pyimp.append((None, a.name, a.asname))
+
+    def visit_ImportFrom(self, node):
+        if self.__phase == 0: return
+        module = '.' * node.level + (node.module or '')
+        for a in node.names:
+            self.pyimp.append((module, a.name, a.asname))
+
+    def visit_Global(self, node):
+        if self.__phase == 0: self.__gdecl.update(node.names)
+
+    def visit_AnnAssign(self, node):
+        LOGGER.debug('PXModule.visit_AnnAssign')
+        if self.__phase == 0: return
+        if not isinstance(node.target, ast.Name): return
+        t = PXVariable.annotationType(node.annotation)
+        if t is None:
+            t = self.__inferType(node.value) if node.value else default_types[type(None)]
+        v = PXVariable.Status.Undefined
+        if node.value:
+            try:
+                v = ast.literal_eval(node.value)
+            except Exception:
+                v = PXVariable.Status.Invalid
+        self.__visit_Global(node.target.id, t, v)
+        # ---  The annotation is authoritative, even for global statements
+        if PXVariable.annotationType(node.annotation):
+            self.glbls[node.target.id].type = t
+
+    def visit_AugAssign(self, node):
+        LOGGER.debug('PXModule.visit_AugAssign')
+        if self.__phase == 0: return
+        if not isinstance(node.target, ast.Name): return
+        try:
+            t = self.glbls[node.target.id].type
+        except KeyError:
+            t = default_types[type(None)]
+        t = self.__inferBinOp(node.op, t, self.__inferType(node.value), node.value)
+        self.__visit_Global(node.target.id, t, PXVariable.Status.Invalid)
+
+    def __visitItem(self, node, visitor):
+        """
+        Visit the top-level definition node with visitor, unless an
+        unchanged definition is in the cache.
+        """
+        if self.lines is None:
+            visitor.doVisit(node)
+            self.__smry[id(visitor)] = self.__summary(node, visitor)
+            return visitor
+        first = min([d.lineno for d in getattr(node, 'decorator_list', [])] + [node.lineno])
+        segment = '\n'.join(self.lines[first-1:node.end_lineno])
+        key = self.cache.key(segment, node, self.opts)
+        hit = self.cache.get(key, node)
+        if hit is None:
+            visitor.doVisit(node)
+            item, smry = visitor, self.__summary(node, visitor)
+            self.cache.put(key, item, smry)
+        else:
+            item, smry = hit
+        self.__smry[id(item)] = smry
+        self.__keys[id(item)] = key
+        return item
+
+    def __summary(self, node, item):
+        """
+        What the module level resolutions need from the definition
+        node, visited as item: its global statements, references,
+        names called in loops and calls.
+        """
+        refs = PXReferences()
+        refs.doVisit(node)
+        return {
+            'glbls': {g for n in ast.walk(node) if isinstance(n, ast.Global) for g in n.names},
+            'extrn': refs.extrn,
+            'bases': refs.bases,
+            'loops': set(self.__loopCalls(node)),
+            'calls': [list(self.__callSites(f.node)) for f in self.__callers(item)],
+        }
+
+    @staticmethod
+    def __callers(item):
+        """
+        The functions of item whose calls are typed
+        """
+        if isinstance(item, PXFunction): return [item]
+        if isinstance(item, PXClass):    return item.meths
+        return []
+
+    @staticmethod
+    def __bindings(node):
+        """
+        Names bound at module level by other statements than the
+        assignments: for, with, import, def, class, except, :=
+        """
+        for n in ast.iter_child_nodes(node):
+            if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                yield n.name
+                continue
+            if isinstance(n, ast.Lambda):
+                continue
+            tgts = []
+            if isinstance(n, (ast.For, ast.AsyncFor)):
+                tgts = [n.target]
+            elif isinstance(n, ast.withitem) and n.optional_vars:
+                tgts = [n.optional_vars]
+            elif isinstance(n, ast.NamedExpr):
+                tgts = [n.target]
+            elif isinstance(n, ast.ExceptHandler) and n.name:
+                yield n.name
+            elif isinstance(n, ast.Import):
+                for a in n.names: yield a.asname or a.name.split('.')[0]
+            elif isinstance(n, ast.ImportFrom):
+                for a in n.names: yield a.asname or a.name
+            for t in tgts:
+                for e in ast.walk(t):
+                    if isinstance(e, ast.Name): yield e.id
+            yield from PXModule.__bindings(n)
+
+    def __rest(self, node):
+        """
+        The module statements that are not definitions
+        """
+        items = {id(i.node) for i in self.items}
+        return [n for n in node.body if id(n) not in items]
 
     def visit_Assign(self, node):
         LOGGER.debug('PXModule.visit_Assign')
@@ -64,54 +417,369 @@ class PXModule(ast.NodeVisitor, PXReader):
         except AttributeError:
             pass
         if isEnum:
-            v = PXEnum()
-            v.doVisit(node)
+            if self.__phase == 1: return
+            v = self.__visitItem(node, PXEnum())
             self.items.append(v)
-        else:
-            self.generic_visit(node)
+        elif self.__phase == 1:
+            t = self.__inferType(node.value)
+            try:
+                v = ast.literal_eval(node.value)
+            except Exception:
+                v = PXVariable.Status.Invalid
+            for tgt in node.targets:
+                if isinstance(tgt, ast.Name):
+                    self.__visit_Global(tgt.id, t, v)
+                elif isinstance(tgt, (ast.Tuple, ast.List)):
+                    for e in tgt.elts:
+                        if isinstance(e, ast.Starred): e = e.value
+                        if isinstance(e, ast.Name):
+                            self.__visit_Global(e.id, default_types[type(None)])
 
     def visit_ClassDef(self, node):
         LOGGER.debug('PXModule.visit_ClassDef')
-        v = PXClass()
-        v.doVisit(node)
+        if self.__phase == 1: return
+        v = self.__visitItem(node, PXClass(self.opts))
         self.items.append(v)
 
     def visit_FunctionDef(self, node):
         LOGGER.debug('PXModule.visit_FunctionDef')
-        v = PXFunction()
-        v.doVisit(node)
+        if self.__phase == 1: return
+        v = self.__visitItem(node, PXFunction(opts=self.opts))
         self.items.append(v)
 
-    def resolveHierarchy(self):
+    def visit_AsyncFunctionDef(self, node):
+        """
+        Coroutines have no pxd declaration, and their body is local
+        """
+        LOGGER.debug('PXModule.visit_AsyncFunctionDef')
+        return
+
+    def resolveHierarchy(self, refs=None):
+        """
+        Resolve the class hierarchy. With the final option, classes
+        without subclasses, in the module or in the project (refs), are
+        final unless listed in the nonFinal option.
+        """
         LOGGER.debug('PXModule.resolveHierarchy')
         clss = [i for i in self.items if isinstance(i, PXClass)]
         for c in clss:
             c.resolveHierarchy(clss)
+        for c in clss:
+            if refs and c.name in refs.bases: c.leaf = False
+            if c.name in self.opts.nonFinal:  c.leaf = False
+            c.final = c.final and c.leaf
+
+    def resolveKinds(self, refs):
+        """
+        Functions and methods never used as python objects, in the module
+        or in the project (refs), can be cdef. Without a project, only
+        the private ones (_name) are made cdef. Methods of a class with
+        a base outside the module, of a class subclassed outside the
+        module or listed in the nonFinal option, and methods overriding
+        each other, stay visible.
+        """
+        LOGGER.debug('PXModule.resolveKinds')
+        funcs = [i for i in self.items if isinstance(i, PXFunction)]
+        clss = {c.name: c for c in self.items if isinstance(c, PXClass)}
+        for c in clss.values():
+            funcs.extend(c.meths)
+            # ---  Python subclasses can override the methods
+            if c.name in self.opts.nonFinal or c.name in refs.bases:
+                for m in c.meths: m.canCdef = False
+            # ---  Overrides are dispatched by the base class
+            for n in self.__ancestors(c, clss):
+                if n not in clss:
+                    for m in c.meths: m.canCdef = False
+                    continue
+                names = {m.name for m in c.meths} & {m.name for m in clss[n].meths}
+                for m in c.meths + clss[n].meths:
+                    if m.name in names: m.canCdef = False
+        for f in funcs:
+            f.canCdef = f.canCdef and f.name not in refs.extrn
+            isPrivate = f.name[:1] == '_'
+            if self.opts.cdef and f.canCdef and (isPrivate or self.opts.project):
+                f.kind = 'cdef'
+
+    @staticmethod
+    def __ancestors(c, clss, seen=()):
+        """
+        Names of the base classes of c, except object
+        """
+        for n in c.bases:
+            if n == 'object' or n in seen: continue
+            yield n
+            if n in clss: yield from PXModule.__ancestors(clss[n], clss, seen + (n,))
+
+    def functions(self):
+        """
+        All the functions and methods
+        """
+        for i in self.items:
+            if isinstance(i, PXFunction):
+                yield i
+            elif isinstance(i, PXClass):
+                for m in i.meths: yield m
+
+    def __callSites(self, node):
+        """
+        The calls in node to functions, f(...), and to methods through
+        self, self.m(...), as (name, isMethod, args). args are (key,
+        type, name), with key the position or the keyword, and type
+        the type of a literal, or else name the name of the value.
+        """
+        for n in ast.walk(node):
+            if not isinstance(n, ast.Call): continue
+            if isinstance(n.func, ast.Name):
+                name, isMeth = n.func.id, False
+            elif isinstance(n.func, ast.Attribute) and \
+                 isinstance(n.func.value, ast.Name) and n.func.value.id == 'self':
+                name, isMeth = n.func.attr, True
+            else:
+                continue
+            vals = list(enumerate(n.args)) + [(k.arg, k.value) for k in n.keywords if k.arg]
+            args = []
+            for key, val in vals:
+                if isinstance(val, ast.Starred): break
+                try:
+                    v = ast.literal_eval(val)
+                    t = pxtype.narrowest(v) if self.opts.narrow else None
+                    args.append((key, t if t else PXVariable.resolveType(type(v)), None))
+                except Exception:
+                    args.append((key, None, val.id if isinstance(val, ast.Name) else None))
+            yield name, isMeth, args
+
+    @staticmethod
+    def __callTypes(sites, f, funcs):
+        """
+        Types of the arguments of the calls sites to the module
+        functions funcs, and to the methods through self. f is the
+        calling PXFunction, if any.
+        """
+        meths = {m.name: m for m in f.clss.meths} if f and f.clss else {}
+        for name, isMeth, args in sites:
+            callee = meths.get(name) if isMeth else funcs.get(name)
+            if not callee: continue
+            names = list(callee.args.keys())[1 if isMeth else 0:]
+            for key, t, ref in args:
+                if isinstance(key, int):
+                    if key >= len(names): continue
+                    key = names[key]
+                elif key not in callee.args:
+                    continue
+                if t is None:
+                    t = default_types[type(None)]
+                    lcl = (f.args.get(ref) or f.locls.get(ref)) if ref and f else None
+                    if lcl: t = lcl.type
+                yield callee, key, t
+
+    def resolveFused(self, node):
+        """
+        Arguments called with integer and floating values get a fused type
+        """
+        LOGGER.debug('PXModule.resolveFused')
+        types = {}
+        calls = []
+        funcs = {i.name: i for i in self.items if isinstance(i, PXFunction)}
+        for i in self.items:
+            for f, sites in zip(self.__callers(i), self.__smry[id(i)]['calls']):
+                calls.extend(self.__callTypes(sites, f, funcs))
+        # ---  Calls at module level
+        for n in node.body:
+            if not isinstance(n, (ast.FunctionDef, ast.ClassDef)):
+                calls.extend(self.__callTypes(self.__callSites(n), None, funcs))
+        for callee, name, t in calls:
+            types.setdefault((id(callee), name), (callee, []))[1].append(t)
+        for (_, name), (callee, ts) in types.items():
+            arg = callee.args[name]
+            members = pxtype.fusedMembers([arg.type] + ts)
+            if members:
+                LOGGER.debug('PXModule.resolveFused: %s(%s) is fused %s', callee.name, name, members)
+                callee.setFused(arg, members)
+
+    def resolveCimports(self, node):
+        """
+        The candidate class names of the functions are extension types
+        if they are cdef classes of the module, or if node imports them
+        from a module whose pxd declares them: they are cimported. The
+        others are objects.
+        """
+        LOGGER.debug('PXModule.resolveCimports')
+        funcs = []
+        for i in self.items:
+            if isinstance(i, PXFunction): funcs.append(i)
+            if isinstance(i, PXClass):    funcs.extend(i.specs + i.meths)
+        cands = set()
+        for f in funcs:
+            cands.update(f.cands)
+        if not cands: return
+        cims = PXCimports(self.path, self.opts.include).resolve(node, cands)
+        # ---  A NamedTuple is a tuple, not a cdef class
+        own  = {c.name for c in self.items if isinstance(c, PXClass) and c.record != 'namedtuple'}
+        objs = cands - set(cims) - own
+        for f in funcs:
+            for a in list(f.args.values()) + list(f.locls.values()):
+                if a.type in objs and not (f.clss and a.name == 'self'):
+                    a.type = default_types[type(None)]
+        for c in self.items:
+            if not isinstance(c, PXClass): continue
+            for a in c.attrs.values():
+                if a.type in objs: a.type = default_types[type(None)]
+        for k in sorted(cims):
+            if cims[k] not in self.imprt: self.imprt.append(cims[k])
+
+    def resolveExcepts(self):
+        """
+        Exception clauses of the functions. noexcept is only for module
+        functions, cdef methods and methods of final classes: a python
+        override could raise. Methods of a hierarchy overriding each
+        other get the same clause, the most permissive one.
+        """
+        LOGGER.debug('PXModule.resolveExcepts')
+        rank = {'noexcept': 0, 'except -1': 1, 'except? -1': 2}
+        for f in self.items:
+            if isinstance(f, PXFunction): f.exc = f.exceptClause()
+        # ---  Classes of the same hierarchy, by root
+        clss = {c.name: c for c in self.items if isinstance(c, PXClass)}
+        roots = {}
+        def root(c, seen=()):
+            for b in c.bases:
+                if b in clss and b not in seen:
+                    return root(clss[b], seen + (c.name,))
+            return c.name
+        for c in clss.values():
+            roots.setdefault(root(c), []).append(c)
+        for cs in roots.values():
+            meths = {}
+            for c in cs:
+                for m in c.meths:
+                    exc = m.exceptClause()
+                    if exc == 'noexcept' and not c.final and m.kind != 'cdef':
+                        exc = m.raiseClause()
+                    meths.setdefault(m.name, []).append((m, exc))
+            for ms in meths.values():
+                exc = max((e for _, e in ms), key=lambda e: rank.get(e, len(rank)))
+                for m, _ in ms:
+                    m.exc = exc
+
+    def resolveFreelists(self, node):
+        """
+        Small classes constructed in loops or comprehensions are
+        allocation hotspots: they get a freelist.
+        """
+        LOGGER.debug('PXModule.resolveFreelists')
+        if not self.opts.freelist: return
+        clss = {i.name: i for i in self.items if isinstance(i, PXClass)}
+        if not clss: return
+        names = set()
+        for n in self.__rest(node):
+            names.update(self.__loopCalls(n, isinstance(n, self.loops)))
+        for sm in self.__smry.values():
+            names.update(sm['loops'])
+        for name in names:
+            c = clss.get(name)
+            if c and not c.freelist and c.canFreelist():
+                LOGGER.debug('PXModule.resolveFreelists: %s', c.name)
+                c.freelist = self.opts.freelist
+
+    @staticmethod
+    def __loopCalls(node, inLoop=False):
+        """
+        Names called in the loops and comprehensions of node
+        """
+        for n in ast.iter_child_nodes(node):
+            if inLoop and isinstance(n, ast.Call) and isinstance(n.func, ast.Name):
+                yield n.func.id
+            yield from PXModule.__loopCalls(n, inLoop or isinstance(n, PXModule.loops))
+
+    def resolveGlobals(self, refs):
+        """
+        A C global is invisible from Python: only the private globals,
+        or with a project those the other modules don't use (refs),
+        are typed.
+        """
+        LOGGER.debug('PXModule.resolveGlobals')
+        for k, g in self.glbls.items():
+            if k[:1] == '_' and k not in refs.pblc: continue
+            if self.opts.project and k not in refs.pblc: continue
+            g.type = default_types[type(None)]
+
+    def resolveConstants(self):
+        """
+        Globals assigned only once, with a numeric literal, are candidates
+        for compile-time constants.
+        """
+        LOGGER.debug('PXModule.resolveConstants')
+        self.cnsts = {}
+        for k, g in self.glbls.items():
+            if self.__nasgn.get(k, 0) != 1 or k in self.__gdecl: continue
+            if k in self.__obind: continue
+            if isinstance(g.val, PXVariable.Status): continue
+            if pxtype.isNumeric(g.type):
+                self.cnsts[k] = g.val
 
     #--------------------
     #   Reader for pxd files
     #--------------------
+    def read_glbl(self, glbl):
+        glbl = glbl.split('cdef ', 1)[1].strip()
+        if glbl[0:7] == 'public ':
+            glbl = glbl[7:].strip()
+        a = PXVariable()
+        a.read_arg(glbl)
+        self.glbls[a.name] = a
+
+    def read_fused(self, decl, fi):
+        assert decl[-1] == ':'
+        name = decl[15:-1].strip()
+        self.fused[name] = []
+        for l in PXReader.read_line(fi):
+            if l == '': break
+            self.fused[name].append(l)
+
     def read(self, fi):
         lcls = {}
-        for l in PXReader.read_line(fi):
+        final = False
+        freelist = 0
+        indents = []
+        for l in PXReader.read_line(fi, indents):
             if l.split(' ')[0] in ['import', 'cimport', 'from']:
                 if l.split(' ')[1] not in ['cython']:
                     self.imprt.append(l)
             elif l[0:11] == 'cdef class ':
                 c = PXClass()
                 c.read(l, fi)
+                c.final = final
+                c.freelist = freelist
                 self.items.append(c)
+                final = False
+                freelist = 0
+            elif l == '@cython.final':
+                final = True
+            elif l[0:17] == '@cython.freelist(':
+                freelist = int(l[17:].split(')')[0])
             elif l[0:10] == 'cdef enum ':
                 c = PXEnum()
                 c.read(l, fi)
                 self.items.append(c)
-            elif l[0:6] == 'cpdef ':
+            elif PXReader.is_var(l):
+                self.read_glbl(l)
+            elif PXReader.is_func(l):
                 f = PXFunction()
                 f.read(l, lcls)
                 self.items.append(f)
                 lcls = {}
             elif l[0:14] == '@cython.locals':
                 lcls = PXReader.read_locals(l)
+            elif l[0:15] == 'ctypedef fused ':
+                self.read_fused(l, fi)
+            elif l[-1:] == ':':
+                # ---  extern, struct, inline function, ... are not read
+                PXReader.skip_block(fi, indents[-1])
+        # ---  Fused types of the arguments
+        for f in self.functions():
+            for a in f.args.values():
+                if a.type in self.fused:
+                    f.fused[a.type] = self.fused[a.type]
 
     #--------------------
     #   Writer for pxd file
@@ -121,7 +789,29 @@ class PXModule(ast.NodeVisitor, PXReader):
         for i in self.imprt:
             fo.write('%s\n' % i)
         fo.write('\n')
+        fused = {}
+        for f in self.functions():
+            for a in f.args.values():
+                if a.type in f.fused:
+                    fused.setdefault(a.type, f.fused[a.type])
+                elif a.type in self.fused:
+                    fused.setdefault(a.type, self.fused[a.type])
+        for k in sorted(fused.keys()):
+            fo.write('ctypedef fused %s:\n' % k)
+            for t in fused[k]:
+                fo.write('    %s\n' % t)
+            fo.write('\n')
+        glbls = [self.glbls[k] for k in sorted(self.glbls.keys())]
+        glbls = [g for g in glbls if g.type not in ['', 'None', default_types[type(None)]]]
+        for g in glbls:
+            s = 'cdef {type:12s} {name}'.format(type=g.type, name=g.name)
+            if g.name in self.cnsts:
+                s = '{s:34s} # constant: {val!r}'.format(s=s, val=self.cnsts[g.name])
+            fo.write('%s\n' % s)
+        if glbls:
+            fo.write('\n')
         for i in self.items:
+            if isinstance(i, PXClass) and not i.hasDecl(): continue
             i.write(fo)
             fo.write('\n')
 
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Options of the generation. They are shared, read only, by all the
+visitors of a module.
+"""
+
+class PXOptions(object):
+    def __init__(self, **kwargs):
+        self.narrow = False     # Narrowest type for the literals (int, float)
+        self.cdef   = False     # cdef for the functions not used from python
+        self.project= []        # Paths of the project, for the references
+        self.final    = False   # @cython.final for the classes without subclasses
+        self.nonFinal = []      # Classes never made final
+        self.structs  = False   # ctypedef struct for the pure data records
+        self.freelist = 8       # Freelist size of the allocation hotspots, 0 for none
+        self.include  = []      # Directories searched for the pxd of the cimports
+        for k, v in kwargs.items():
+            if not hasattr(self, k):
+                raise AttributeError('Unknown option: %s' % k)
+            setattr(self, k, v)
+
+    def __repr__(self):
+        opts = ['%s=%r' % (k, v) for k, v in sorted(vars(self).items())]
+        return 'PXOptions(%s)' % ', '.join(opts)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Hotspot selection from cProfile/pstats data. Only the functions and
+methods above a cumulative time threshold are kept in a visited
+module, the others are left to the existing pxd.
+"""
+
+import hashlib
+import logging
+import os
+import pstats
+
+from .pxvariable import default_types
+from .pxfunction import PXFunction
+from .pxclass    import PXClass
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.profile")
+
+# ---  Number of constructions of an allocation hotspot
+freelist_min_calls = 1000
+
+class PXProfile(object):
+    def __init__(self, path, threshold='0'):
+        """
+        path is a file saved by cProfile/pstats. threshold is the
+        cumulative time, in seconds, or in percent of the total time
+        if it ends with '%'.
+        """
+        self.path = path
+        self.stats = pstats.Stats(path).stats
+        total = sum(s[2] for s in self.stats.values())
+        threshold = str(threshold).strip()
+        if threshold.endswith('%'):
+            self.threshold = float(threshold[:-1]) / 100.0 * total
+        else:
+            self.threshold = float(threshold)
+        with open(path, 'rb') as fi:
+            self.digest = hashlib.md5(fi.read()).hexdigest()
+
+    def __repr__(self):
+        return 'PXProfile(%s, %s)' % (self.digest, self.threshold)
+
+    def __entries(self, fname, col=3):
+        """
+        Profile entries {(name, line): cumtime} for the file fname, or
+        the column col of the stats (1 for the number of calls).
+        Files are matched on their real path, or else on their name.
+        """
+        entries = {}
+        rpath = os.path.realpath(fname)
+        bname = os.path.basename(fname)
+        for byName in (False, True):
+            for (fn, line, name), stat in self.stats.items():
+                ct = stat[col]
+                if byName:
+                    match = os.path.basename(fn) == bname
+                else:
+                    match = os.path.realpath(fn) == rpath
+                if match:
+                    entries[(name, line)] = entries.get((name, line), 0.0) + ct
+            if entries: break
+        return entries
+
+    def isHot(self, fname):
+        """
+        Check if some code of the file fname is above the threshold
+        """
+        return any(ct >= self.threshold and ct > 0.0 for ct in self.__entries(fname).values())
+
+    @staticmethod
+    def __cumtime(entries, f):
+        node = f.node
+        if node is None: return 0.0
+        first = min([d.lineno for d in node.decorator_list] + [node.lineno])
+        return sum(ct for (n, l), ct in entries.items()
+                   if n == f.name and first <= l <= node.lineno)
+
+    def allocations(self, mdl, fname):
+        """
+        Give a freelist to the small classes of mdl constructed at
+        least freelist_min_calls times.
+        """
+        if not mdl.opts.freelist: return
+        entries = self.__entries(fname, col=1)
+        for c in mdl.items:
+            if not isinstance(c, PXClass) or c.freelist: continue
+            for m in c.specs:
+                if m.name != '__init__': continue
+                nc = self.__cumtime(entries, m)
+                if nc >= freelist_min_calls and c.canFreelist():
+                    LOGGER.debug('PXProfile.allocations: %s constructed %d times', c.name, nc)
+                    c.freelist = mdl.opts.freelist
+
+    def select(self, mdl, fname):
+        """
+        Keep in mdl only the functions and methods above the threshold,
+        with their classes. Returns the hot callables as a list of
+        (cumtime, class, function), by decreasing time.
+        """
+        LOGGER.debug('PXProfile.select: %s', fname)
+        entries = self.__entries(fname)
+        hot = []
+        items = []
+        for i in mdl.items:
+            if isinstance(i, PXFunction):
+                ct = self.__cumtime(entries, i)
+                if ct >= self.threshold and ct > 0.0:
+                    hot.append((ct, None, i))
+                    items.append(i)
+            elif isinstance(i, PXClass):
+                meths = []
+                for m in i.specs + i.meths:
+                    ct = self.__cumtime(entries, m)
+                    if ct >= self.threshold and ct > 0.0:
+                        hot.append((ct, i, m))
+                        meths.append(m)
+                if meths:
+                    i.meths = [m for m in i.meths if m in meths]
+                    items.append(i)
+            else:
+                items.append(i)
+        mdl.items = items
+        hot.sort(key=lambda h: -h[0])
+        return hot
+
+    @staticmethod
+    def report(hot, fo):
+        """
+        Write the hot callables that still have untyped arguments, locals
+        or return type. A function that returns no value, with an empty
+        or an object return type, has no return type to report.
+        """
+        untyped = ['', 'None', default_types[type(None)]]
+        for ct, c, f in hot:
+            args = [a.name for a in f.args.values() if a.type in untyped]
+            lcls = [l.name for l in f.locls.values() if l.type in untyped]
+            ret  = f.type in untyped and f.returnsValue()
+            if not args and not lcls and not ret: continue
+            name = '%s.%s' % (c.name, f.name) if c else f.name
+            msg = []
+            if args: msg.append('args: %s' % ', '.join(args))
+            if lcls: msg.append('locals: %s' % ', '.join(sorted(lcls)))
+            if ret: msg.append('return')
+            fo.write('%10.3fs  %-32s %s\n' % (ct, name, '; '.join(msg)))
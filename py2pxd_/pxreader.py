@@ -7,19 +7,26 @@ from .pxvariable import PXVariable
 
 LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.reader")
 
+# ---  Qualifiers of the declarations that are not read
+skip_words = ['inline', 'extern', 'api', 'struct', 'union', 'enum', 'packed',
+              'class', 'cppclass', 'ctypedef']
+
 class PXReader(object):
     def __init__(self):
         pass
 
     @staticmethod
-    def read_line(fi):
+    def read_line(fi, indents=None):
         """
-        Load a complete statement that can be spread over multiple lines
+        Load a complete statement that can be spread over multiple lines.
+        If indents is a list, the indentation of each statement is
+        appended to it.
         """
         ls = []
         while True:
             l = fi.readline()
             if not l: break  # eof
+            if not ls: indent = len(l) - len(l.lstrip())
             # ---  Clean
             l = l.strip()
             if l and l[0] != '#':      # Keep comment only line
@@ -38,8 +45,43 @@ class PXReader(object):
                 ls = []
                 while '  ' in l: l = l.replace('  ', ' ')
                 LOGGER.debug('PXReader.read_line: %s', l)
+                if indents is not None: indents.append(indent)
                 yield l
 
+    @staticmethod
+    def skip_block(fi, indent):
+        """
+        Skip the block of a statement ending with ':' and indented by
+        indent: the following lines indented more. fi must be seekable.
+        """
+        while True:
+            pos = fi.tell()
+            l = fi.readline()
+            if not l: return
+            if l.strip() and len(l) - len(l.lstrip()) <= indent:
+                fi.seek(pos)
+                return
+
+    @staticmethod
+    def is_func(l):
+        """
+        Check if l declares a function: "cdef [type] name(...)" or
+        "cpdef [type] name(...)", not an inline, extern, ... nor a block.
+        """
+        if l[0:6] != 'cpdef ' and l[0:5] != 'cdef ': return False
+        if l[-1:] == ':' or '(' not in l: return False
+        return not set(l.split('(')[0].split()[1:]) & set(skip_words)
+
+    @staticmethod
+    def is_var(l):
+        """
+        Check if l declares a variable: "cdef [public] type name"
+        """
+        if l[0:5] != 'cdef ' or l[-1:] == ':' or '(' in l or '=' in l: return False
+        ws = l.split()[1:]
+        if ws[:1] == ['public']: ws = ws[1:]
+        return len(ws) >= 2 and not set(ws) & set(skip_words)
+
     @staticmethod
     def read_locals(l):
         """
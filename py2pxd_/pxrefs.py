@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reference analysis. Collect the names of the functions and methods
+that are used as Python objects, and not only called directly (f(...))
+or through self (self.m(...)). Those must stay visible from Python.
+"""
+
+import ast
+import logging
+import os
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.refs")
+
+class PXReferences(ast.NodeVisitor):
+    def __init__(self):
+        super(PXReferences, self).__init__()
+        self.extrn = set()      # names referenced as objects
+        self.calls = set()      # id of the nodes called directly
+        self.bases = set()      # base class names
+        self.pblc  = set()      # names used by the other modules
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Name):
+            self.calls.add(id(func))
+        elif isinstance(func, ast.Attribute) and \
+             isinstance(func.value, ast.Name) and func.value.id == 'self':
+            self.calls.add(id(func))
+        # ---  getattr(o, 'name'), hasattr, setattr
+        if isinstance(func, ast.Name) and func.id in ['getattr', 'hasattr', 'setattr']:
+            for a in node.args[1:2]:
+                if isinstance(a, ast.Constant) and isinstance(a.value, str):
+                    self.extrn.add(a.value)
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if id(node) not in self.calls:
+            self.extrn.add(node.id)
+
+    def visit_Attribute(self, node):
+        if id(node) not in self.calls:
+            self.extrn.add(node.attr)
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        for a in node.names:
+            self.extrn.add(a.name)
+
+    def visit_ClassDef(self, node):
+        for b in node.bases:
+            if isinstance(b, ast.Name):
+                self.bases.add(b.id)
+            elif isinstance(b, ast.Attribute):
+                self.bases.add(b.attr)
+        self.generic_visit(node)
+
+    def visit_Assign(self, node):
+        # ---  __all__ = [...]
+        for tgt in node.targets:
+            if isinstance(tgt, ast.Name) and tgt.id == '__all__':
+                try:
+                    self.extrn.update(ast.literal_eval(node.value))
+                    self.pblc.update(ast.literal_eval(node.value))
+                except Exception:
+                    pass
+        self.generic_visit(node)
+
+    def doVisit(self, node):
+        LOGGER.debug('PXReferences.doVisit')
+        self.visit(node)
+
+    def doVisitProject(self, paths, exclude=None):
+        """
+        Visit all the python files in paths (files or directories),
+        except the file exclude. Every name used in the project counts
+        as an external reference.
+        """
+        LOGGER.debug('PXReferences.doVisitProject')
+        exclude = os.path.realpath(exclude) if exclude else None
+        for fname in self.projectFiles(paths):
+            if os.path.realpath(fname) == exclude: continue
+            try:
+                with open(fname, 'rt') as fi:
+                    tree = ast.parse(fi.read())
+            except (IOError, SyntaxError, UnicodeDecodeError) as e:
+                LOGGER.warning('PXReferences: skipping %s: %s', fname, str(e))
+                continue
+            # ---  In other modules, calls are references too
+            r = PXReferences()
+            r.visit(tree)
+            self.bases.update(r.bases)
+            for n in ast.walk(tree):
+                if isinstance(n, ast.Name):
+                    self.extrn.add(n.id)
+                    self.pblc.add(n.id)
+                elif isinstance(n, ast.Attribute):
+                    self.extrn.add(n.attr)
+                    self.pblc.add(n.attr)
+            self.extrn.update(r.extrn)
+            self.pblc.update(r.extrn)
+
+    @staticmethod
+    def projectFiles(paths):
+        for p in paths:
+            if os.path.isdir(p):
+                for root, _, files in os.walk(p):
+                    for f in sorted(files):
+                        if f.endswith('.py'):
+                            yield os.path.join(root, f)
+            elif os.path.isfile(p):
+                yield p
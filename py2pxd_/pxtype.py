@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Lattice of the cython types, used to merge types. Two types are
+merged to their least upper bound: the narrowest type that can
+hold the values of both.
+
+'', 'None' and 'object' are the unknown types, below every known
+type: merged with a known type, the known type wins. Types not in
+the lattice (classes, ...) only merge with themselves.
+"""
+
+import logging
+import struct
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.type")
+
+# ---  Unknown types, by increasing rank
+unknown_types = ['', 'None', 'object']
+
+# ---  Direct super-types of the types
+type_parents = {
+    'bint'              : ['signed char', 'unsigned char'],
+    'char'              : ['short'],
+    'signed char'       : ['short'],
+    'unsigned char'     : ['short', 'unsigned short'],
+    'short'             : ['int', 'float'],
+    'unsigned short'    : ['int', 'unsigned int', 'float'],
+    'int'               : ['long', 'double'],
+    'unsigned int'      : ['long', 'unsigned long', 'double'],
+    # py2pxd types every integer literal as long: a Py_ssize_t in
+    # the pxd is a deliberate choice and wins.
+    'long'              : ['Py_ssize_t', 'long long', 'double'],
+    'Py_ssize_t'        : ['long long'],
+    'unsigned long'     : ['size_t'],
+    'size_t'            : ['unsigned long long'],
+    'long long'         : ['double'],
+    # Mixed-sign integers merge to the widest signed type, not to
+    # a floating point type that would lose the integral semantics.
+    # No signed type has an unsigned parent.
+    'unsigned long long': ['long long'],
+    'float'             : ['double'],
+    'double'            : ['long double'],
+    'long double'       : ['object'],
+    #
+    'str'               : ['object'],
+    'bytes'             : ['object'],
+    'unicode'           : ['object'],
+    'list'              : ['object'],
+    'dict'              : ['object'],
+    'tuple'             : ['object'],
+    'set'               : ['object'],
+    'frozenset'         : ['object'],
+    'object'            : [],
+}
+
+def ancestors(t):
+    """
+    Ancestors of t, with their distance (longest path) to t
+    """
+    a = {t: 0}
+    for p in type_parents[t]:
+        for k, d in ancestors(p).items():
+            a[k] = max(a.get(k, 0), d + 1)
+    return a
+
+type_ancestors = { t: ancestors(t) for t in type_parents }
+
+# ---  Joins outside of the lattice: a size_t in the pxd is a
+#      deliberate choice and wins over the long of the literals
+type_overrides = {
+    ('long', 'size_t'): 'size_t',
+}
+
+int_types = ['bint', 'char', 'signed char', 'unsigned char', 'short', 'unsigned short',
+             'int', 'unsigned int', 'long', 'unsigned long', 'Py_ssize_t', 'size_t',
+             'long long', 'unsigned long long']
+float_types = ['float', 'double', 'long double']
+
+def isInteger(t):
+    return t in int_types
+
+def isFloating(t):
+    return t in float_types
+
+def isNumeric(t):
+    return t in int_types or t in float_types
+
+def isMemoryView(t):
+    return t.endswith(']') and '[' in t
+
+def splitMemoryView(t):
+    """
+    'double[:, ::1]' gives ('double', [':', '::1'])
+    """
+    dtype, dims = t[:-1].split('[', 1)
+    return dtype.strip(), [d.strip() for d in dims.split(',')]
+
+def joinMemoryView(t1, t2):
+    d1, s1 = splitMemoryView(t1)
+    d2, s2 = splitMemoryView(t2)
+    if d1 != d2 or len(s1) != len(s2):
+        return 'object'
+    # ---  Contiguity is kept where both agree
+    dims = [a if a == b else ':' for a, b in zip(s1, s2)]
+    return '%s[%s]' % (d1, ', '.join(dims))
+
+def isKnown(t):
+    return t in type_parents or isMemoryView(t)
+
+def join(t1, t2):
+    """
+    Least upper bound of the types t1 and t2.
+    Returns None if the types are not comparable.
+    """
+    if t1 == t2:
+        return t1
+    # ---  Unknown types
+    if t1 in unknown_types and t2 in unknown_types:
+        return max(t1, t2, key=unknown_types.index)
+    if t1 in unknown_types: return t2
+    if t2 in unknown_types: return t1
+    # ---  Known types
+    if not isKnown(t1) or not isKnown(t2):
+        return None
+    if isMemoryView(t1) and isMemoryView(t2):
+        return joinMemoryView(t1, t2)
+    if isMemoryView(t1) or isMemoryView(t2):
+        return 'object'
+    t = type_overrides.get((t1, t2)) or type_overrides.get((t2, t1))
+    if t: return t
+    a1 = type_ancestors[t1]
+    a2 = type_ancestors[t2]
+    cmn = [t for t in a1 if t in a2]
+    return min(cmn, key=lambda t: (max(a1[t], a2[t]), a1[t] + a2[t]))
+
+def joinStrict(t1, t2):
+    """
+    Least upper bound of t1 and t2 for values assigned to the same
+    variable: an unknown type is an object, at the top of the lattice.
+    """
+    if t1 == t2:
+        return t1
+    if t1 in unknown_types or t2 in unknown_types:
+        return 'object'
+    t = join(t1, t2)
+    return 'object' if t is None else t
+
+def fusedMembers(types):
+    """
+    Members of a fused type for the numeric types: the integer types
+    are merged together, and so are the floating types.
+    Returns None if the types don't mix integers and floats.
+    """
+    types = [t for t in types if t not in unknown_types]
+    if not all(isNumeric(t) for t in types):
+        return None
+    ints = [t for t in types if isInteger(t)]
+    flts = [t for t in types if isFloating(t)]
+    if not ints or not flts:
+        return None
+    ti, tf = ints[0], flts[0]
+    for t in ints: ti = join(ti, t)
+    for t in flts: tf = join(tf, t)
+    return [ti, tf]
+
+def fusedName(members):
+    """
+    Name of the fused type for members
+    """
+    return 'fused_' + '_'.join(m.replace(' ', '') for m in members)
+
+# ---  struct format of the C types, for their size
+type_formats = {
+    'bint'              : 'i',
+    'char'              : 'b',
+    'signed char'       : 'b',
+    'unsigned char'     : 'B',
+    'short'             : 'h',
+    'unsigned short'    : 'H',
+    'int'               : 'i',
+    'unsigned int'      : 'I',
+    'long'              : 'l',
+    'unsigned long'     : 'L',
+    'Py_ssize_t'        : 'n',
+    'size_t'            : 'N',
+    'long long'         : 'q',
+    'unsigned long long': 'Q',
+    'float'             : 'f',
+    'double'            : 'd',
+    'long double'       : 'dd',     # at least
+}
+
+def sizeOf(t):
+    """
+    Size in bytes of the numeric type t, None for the other types
+    """
+    try:
+        return struct.calcsize(type_formats[t])
+    except KeyError:
+        return None
+
+# ---  Value ranges of the narrow types
+int_ranges = [
+    ('int',       -2**31, 2**31-1),
+    ('long long', -2**63, 2**63-1),
+]
+
+def narrowest(v):
+    """
+    Narrowest type that can hold the value v, preferring int and float
+    over long and double.
+    Returns None if v is not a number.
+    """
+    if isinstance(v, bool):
+        return 'bint'
+    if isinstance(v, int):
+        for t, lo, hi in int_ranges:
+            if lo <= v <= hi: return t
+        return 'object'
+    if isinstance(v, float):
+        try:
+            if struct.unpack('f', struct.pack('f', v))[0] == v:
+                return 'float'
+        except OverflowError:
+            pass
+        return 'double'
+    return None
+
+
+if __name__ == "__main__":
+    def main():
+        for t1, t2 in [('long', 'size_t'), ('int', 'float'), ('bint', 'long'),
+                       ('double[::1]', 'double[:]'), ('list', 'dict')]:
+            print(t1, '|', t2, '->', join(t1, t2))
+
+    streamHandler = logging.StreamHandler()
+    LOGGER.addHandler(streamHandler)
+    LOGGER.setLevel(logging.DEBUG)
+
+    main()
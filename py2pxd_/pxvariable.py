@@ -8,6 +8,8 @@ import ast
 import enum
 import logging
 
+from . import pxtype
+
 LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.variable")
 
 default_types = {
@@ -28,8 +30,31 @@ default_types = {
     type(ast.Str())  : 'str',
 }
 
+annotation_types = {
+    'int'   : 'long',
+    'float' : 'double',
+    'bool'  : 'bint',
+    'str'   : 'str',
+    'bytes' : 'bytes',
+    'list'  : 'list',
+    'dict'  : 'dict',
+    'tuple' : 'tuple',
+    'set'   : 'set',
+}
+
+cython_types = {
+    'schar'     : 'signed char',
+    'uchar'     : 'unsigned char',
+    'ushort'    : 'unsigned short',
+    'uint'      : 'unsigned int',
+    'ulong'     : 'unsigned long',
+    'longlong'  : 'long long',
+    'ulonglong' : 'unsigned long long',
+    'longdouble': 'long double',
+}
+
 class PXVariable(object):
-    Status = enum.Enum('Status', ('OK', 'Undefined', 'EvalError', 'Invalid'))
+    Status = enum.Enum('Status', ('OK', 'Undefined', 'EvalError', 'Invalid'), qualname='PXVariable.Status')
 
     def __init__(self):
         self.name = ''
@@ -48,20 +73,12 @@ class PXVariable(object):
         LOGGER.debug('PXVariable.merge: %s', self.name)
         LOGGER.debug('    merge type:  %s and %s', self.type, other.type)
         if self.type != other.type:
-            if   self.type in ['']:
-                if other.type not in ['']: self.type = other.type
-            elif self.type in ['None']:
-                if other.type not in ['', 'None']: self.type = other.type
-            elif self.type in ['object']:
-                if other.type not in ['', 'None', 'object']: self.type = other.type
-            elif other.type in ['', 'None', 'object']:
-                pass
-            elif self.type in ['long'] and other.type in ['size_t']:
-                LOGGER.debug('    promoting %s to %s', self.type, other.type)
-                self.type = other.type
-            else:
+            t = pxtype.join(self.type, other.type)
+            if t is None:
                 self.type = '__conflict__type__: "%s" "%s"' % (self.type, other.type)
                 cnflct = True
+            else:
+                self.type = t
         LOGGER.debug('    merged to %s', self.type)
         if cnflct: LOGGER.warn('PXVariable.merge: %s: %s', self.name, self.type)
 
@@ -85,12 +102,13 @@ class PXVariable(object):
     #--------------------
     #   Python source code parser (ast visitors)
     #--------------------
-    def doVisit(self, name, type_name=None, value=Status.Undefined):
+    def doVisit(self, name, type_name=None, value=Status.Undefined, narrow=False):
         LOGGER.debug('PXVariable.doVisit: %s with type %s and value %s', name, type_name, value)
         v, t = PXVariable.Status.Undefined, None
         try:
             v = ast.literal_eval(value)
-            t = v
+            t = type(v)     # a str value is not a type name
+            if narrow: t = pxtype.narrowest(v) or t
         except Exception:
             if isinstance(value, ast.Attribute):
                 v = PXVariable.Status.EvalError
@@ -102,22 +120,55 @@ class PXVariable(object):
                 v = PXVariable.Status.Undefined
                 t = type_name
 
+        self.type = PXVariable.resolveType(t)
+        self.val  = v
+        self.name = name
+        LOGGER.debug('    %s as %s', self.name, self.val)
+
+    @staticmethod
+    def resolveType(t):
+        """
+        Cython type name for t, a python type, a type name or a value.
+        """
         if isinstance(t, type):
-            self.type = default_types[t]
+            return default_types.get(t, default_types[type(None)])
         elif isinstance(t, str):
             try:
-                self.type = default_types[t]
+                return default_types[t]
             except KeyError:
-                self.type = t
+                return t
         else:
             try:
-                self.type = default_types[type(t)]
+                return default_types[type(t)]
             except KeyError:
-                self.type = str(t)
+                return str(t)
 
-        self.val  = v
-        self.name = name
-        LOGGER.debug('    %s as %s', self.name, self.val)
+    @staticmethod
+    def annotationType(node):
+        """
+        Translate a type annotation to a cython type name.
+        Python builtins are mapped with annotation_types, cython.xxx
+        types are taken as is and Final[...] is unwrapped.
+        Returns None if the annotation can not be translated.
+        """
+        if isinstance(node, ast.Subscript):
+            if PXVariable.annotationType(node.value) == 'Final':
+                return PXVariable.annotationType(node.slice)
+            return None
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            try:
+                node = ast.parse(node.value, mode='eval').body
+            except SyntaxError:
+                return None
+        if isinstance(node, ast.Name):
+            if node.id == 'Final': return node.id
+            return annotation_types.get(node.id, None)
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            if node.value.id == 'cython':
+                return cython_types.get(node.attr, node.attr)
+            if node.value.id == 'typing' and node.attr == 'Final':
+                return node.attr
+        return None
 
     #--------------------
     #   Reader for pxd files
@@ -133,7 +184,7 @@ class PXVariable(object):
         except Exception:
             v = ''
         try:
-            t, n = arg.split(' ')
+            t, n = arg.rsplit(' ', 1)
         except Exception:
             t, n = self.type, arg
         self.name = n.strip()
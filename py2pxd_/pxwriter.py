@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Writers render a visited and merged PXModule. The same model can be
+written in many formats, without parsing the sources again.
+"""
+
+import ast
+import datetime
+import io
+import logging
+
+from .           import pxtype
+from .pxvariable import PXVariable
+from .pxclass    import PXClass
+from .pxenum     import PXEnum
+from .pxmodule   import __version__, HEADER
+
+LOGGER = logging.getLogger("INRS.IEHSS.Python.cython.writer")
+
+class PXWriter(object):
+    """
+    Base class for the writers. ext is the file extension of the
+    output, header the leading part of the output that is ignored
+    when comparing with an existing file.
+    """
+    ext    = ''
+    header = ''
+
+    def write(self, mdl, fo):
+        raise NotImplementedError
+
+
+class PXDWriter(PXWriter):
+    """
+    Cython .pxd declarations, rendered by the model itself.
+    """
+    ext    = '.pxd'
+    header = HEADER
+
+    def write(self, mdl, fo):
+        mdl.write(fo)
+
+
+pyi_types = {
+    ''          : 'Any',
+    'None'      : 'Any',
+    'object'    : 'Any',
+    'bint'      : 'bool',
+    'char'      : 'int',
+    'short'     : 'int',
+    'int'       : 'int',
+    'long'      : 'int',
+    'long long' : 'int',
+    'size_t'    : 'int',
+    'Py_ssize_t': 'int',
+    'float'     : 'float',
+    'double'    : 'float',
+    'long double': 'float',
+}
+
+class PYIWriter(PXWriter):
+    """
+    Python .pyi stubs. The imports of the source binding the names
+    used by the stubs (bases, decorators, types) are kept.
+    """
+    ext    = '.pyi'
+    header = """\
+# -*- coding: utf-8 -*-
+
+# This is an automatically generated file.
+#
+# Generated by %s version %s on %s
+
+from typing import Any
+""" % (__package__,
+       __version__,
+       datetime.datetime.now().replace(microsecond=0).isoformat(' '))
+
+    def __init__(self):
+        self.names = set()      # names used by the stubs
+
+    def use(self, expr):
+        """
+        Record the name at the root of the dotted expression expr
+        """
+        self.names.add(expr.split('.')[0].split('(')[0])
+        return expr
+
+    @staticmethod
+    def pyiType(t):
+        try:
+            return pyi_types[t]
+        except KeyError:
+            pass
+        if t.startswith('unsigned ') or t.startswith('signed '):
+            return 'int'
+        if '[' in t or ' ' in t or ':' in t:
+            return 'Any'    # memoryviews, conflicts, ...
+        return t
+
+    def pyiArg(self, f, name, i, dflt):
+        """
+        The argument name of f, at position i, typed from the model
+        """
+        a = f.args.get(name)
+        if i == 0 and f.clss and name in ['self', 'cls']:
+            arg = name
+        elif a is None:
+            arg = '%s: Any' % name
+        elif a.type in f.fused:
+            # ---  int is accepted for float
+            t = 'float' if any(pxtype.isFloating(m) for m in f.fused[a.type]) else 'int'
+            arg = '%s: %s' % (name, t)
+        else:
+            arg = '%s: %s' % (name, self.use(self.pyiType(a.type)))
+        return arg + ' = ...' if dflt else arg
+
+    def signature(self, f):
+        """
+        The arguments of f: those of its node, with *args, keyword-only
+        and **kwargs, or those of the model read from a pxd
+        """
+        if f.node is None:
+            undef = [PXVariable.Status.Undefined, PXVariable.Status.Invalid]
+            return [self.pyiArg(f, a.name, i, a.val not in undef) for i, a in enumerate(f.args.values())]
+        n = f.node.args
+        pos = n.posonlyargs + n.args
+        dflts = [None] * (len(pos) - len(n.defaults)) + n.defaults
+        args = []
+        for i, (a, d) in enumerate(zip(pos, dflts)):
+            args.append(self.pyiArg(f, a.arg, i, d is not None))
+            if i == len(n.posonlyargs) - 1: args.append('/')
+        if n.vararg:
+            args.append('*%s: Any' % n.vararg.arg)
+        elif n.kwonlyargs:
+            args.append('*')
+        for a, d in zip(n.kwonlyargs, n.kw_defaults):
+            args.append(self.pyiArg(f, a.arg, -1, d is not None))
+        if n.kwarg:
+            args.append('**%s: Any' % n.kwarg.arg)
+        return args
+
+    def write_function(self, f, fo, indent=0):
+        # ---  staticmethod, classmethod, property, ...
+        for d in getattr(f.node, 'decorator_list', []):
+            if isinstance(d, (ast.Name, ast.Attribute)):
+                fo.write('{indent}@{deco}\n'.format(indent=' '*indent, deco=self.use(ast.unparse(d))))
+        args = self.signature(f)
+        rtype = self.use(self.pyiType(f.type)) if f.type else 'None'
+        fmt = '{indent}def {name}({args}) -> {type}: ...\n'
+        fo.write(fmt.format(indent=' '*indent, name=f.name, args=', '.join(args), type=rtype))
+
+    def write_class(self, c, fo, indent=0):
+        bases = ''
+        if c.bases:
+            bases = '(%s)' % ', '.join(self.use(b) for b in c.bases)
+        if c.deco:
+            fo.write('{indent}@{deco}\n'.format(indent=' '*indent, deco=self.use(c.deco)))
+        fo.write('{indent}class {name}{bases}:\n'.format(indent=' '*indent, name=c.name, bases=bases))
+        indent += 4
+        meths = c.specs + c.meths
+        for a in c.fields():
+            t = self.use(self.pyiType(a.type))
+            if c.record and a.val != PXVariable.Status.Undefined: t += ' = ...'
+            fo.write('{indent}{name}: {type}\n'.format(indent=' '*indent, name=a.name, type=t))
+        for m in meths:
+            if m.kind == 'cdef': continue   # not visible from python
+            self.write_function(m, fo, indent=indent)
+        if not c.attrs and not meths:
+            fo.write('{indent}...\n'.format(indent=' '*indent))
+
+    def write_enum(self, e, fo, indent=0):
+        fo.write('{indent}class {name}(enum.Enum):\n'.format(indent=' '*indent, name=e.name))
+        indent += 4
+        for a in e.attrs:
+            fo.write('{indent}{name}: int\n'.format(indent=' '*indent, name=a.name))
+        if not e.attrs:
+            fo.write('{indent}...\n'.format(indent=' '*indent))
+
+    def write_imports(self, mdl, fo):
+        for module, name, asname in mdl.pyimp:
+            bound = asname or (name if module is not None else name.split('.')[0])
+            if bound not in self.names or bound in ['Any', 'enum']: continue
+            alias = ' as %s' % asname if asname else ''
+            if module is None:
+                fo.write('import %s%s\n' % (name, alias))
+            else:
+                fo.write('from %s import %s%s\n' % (module, name, alias))
+
+    def write(self, mdl, fo):
+        # ---  The body first, for the names it uses
+        body = io.StringIO()
+        self.write_body(mdl, body)
+        fo.write(self.header)
+        if any(isinstance(i, PXEnum) for i in mdl.items):
+            fo.write('import enum\n')
+        self.write_imports(mdl, fo)
+        fo.write('\n')
+        fo.write(body.getvalue())
+
+    def write_body(self, mdl, fo):
+        for k in sorted(mdl.glbls.keys()):
+            g = mdl.glbls[k]
+            fo.write('{name}: {type}\n'.format(name=g.name, type=self.use(self.pyiType(g.type))))
+        if mdl.glbls:
+            fo.write('\n')
+        for i in mdl.items:
+            if isinstance(i, PXClass):
+                self.write_class(i, fo)
+            elif isinstance(i, PXEnum):
+                self.write_enum(i, fo)
+            elif i.kind == 'cdef':
+                continue
+            else:
+                self.write_function(i, fo)
+            fo.write('\n')
+
+
+WRITERS = {
+    'pxd': PXDWriter,
+    'pyi': PYIWriter,
+}
+
+def registerWriter(fmt, writer):
+    """
+    Register a PXWriter subclass for the format fmt
+    """
+    LOGGER.debug('registerWriter: %s', fmt)
+    WRITERS[fmt] = writer
+
+
+if __name__ == "__main__":
+    def main():
+        w = PYIWriter()
+
+    streamHandler = logging.StreamHandler()
+    LOGGER.addHandler(streamHandler)
+    LOGGER.setLevel(logging.DEBUG)
+
+    main()
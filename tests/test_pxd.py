@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Round trips of the pxd files: read, merge and write
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import py2pxd_ as PX
+from py2pxd_ import pxtype
+
+def body(pxd):
+    """
+    The pxd without its header, which holds the date
+    """
+    return pxd.split(PX.HEADER, 1)[-1]
+
+def remerge(src, pxd, opts=None):
+    mdl = PX.buildModule(src, opts=opts)
+    PX.mergeModule(mdl, pxd)
+    return PX.renderModule(mdl)
+
+hand_src = """
+def sq(x):
+    return x * x
+
+def _h(a: float) -> float:
+    return a + 1.0
+
+class A:
+    def _m(self, x: int) -> int:
+        return x
+"""
+
+hand_pxd = """
+import cython
+
+cdef extern from "math.h":
+    double sqrt(double x)
+    cdef struct X:
+        double a
+
+    cdef enum E:
+        E1
+
+cdef inline double sq(double x):
+    return x * x
+
+cdef double       _h              (double a) except? -1
+
+cdef class A:
+    cdef inline long f(self):
+        cdef long y = 1
+        return y
+    cdef long         _m              (A self, long x)
+"""
+
+def test_read_write_hand_pxd():
+    out = body(remerge(hand_src, hand_pxd))
+    for word in ['inline', 'extern', 'struct', 'sqrt', ' :']:
+        assert word not in out, word
+    assert 'cdef  double       _h              (double a) except? -1' in out
+    assert 'cdef  long         _m              (A self, long x)' in out
+    # ---  Reading back the output gives the same output
+    assert body(remerge(hand_src, out)) == out
+
+async_src = """
+_A = 1
+
+async def g(n):
+    _tmp = 2.5
+    _A = "x"
+    def inner(y): return y
+    return n
+"""
+
+def test_async_locals():
+    out = body(PX.renderModule(PX.buildModule(async_src)))
+    assert 'cdef long         _A               # constant: 1' in out
+    for name in ['_tmp', 'inner', ' g ']:
+        assert name not in out, name
+
+final_src = """
+class B:
+    pass
+
+class C(B):
+    pass
+
+class D:
+    pass
+"""
+
+def test_final_is_opt_in():
+    out = body(PX.renderModule(PX.buildModule(final_src)))
+    assert '@cython.final' not in out
+    out = body(PX.renderModule(PX.buildModule(final_src, opts=PX.PXOptions(final=True))))
+    assert out.count('@cython.final') == 2
+    assert '@cython.final\ncdef class B' not in out
+    # ---  A final from the pxd is kept, on a class without subclass
+    pxd = '@cython.final\ncdef class B:\n    pass\n\n@cython.final\ncdef class D:\n    pass\n'
+    out = body(remerge(final_src, pxd))
+    assert '@cython.final\ncdef class D' in out
+    assert '@cython.final\ncdef class B' not in out
+
+def test_not_final_methods_stay_cpdef():
+    src = 'class A:\n    def _m(self, x):\n        return x\n'
+    out = body(PX.renderModule(PX.buildModule(src, opts=PX.PXOptions(cdef=True))))
+    assert 'cdef  object       _m' in out
+    opts = PX.PXOptions(cdef=True, nonFinal=['A'])
+    out = body(PX.renderModule(PX.buildModule(src, opts=opts)))
+    assert 'cpdef object       _m' in out
+
+round_src = """
+_N = 10
+_scale: float = 1.5
+_calls = 0
+
+def set_scale(s: float):
+    global _scale, _calls
+    _scale = s
+    _calls += 1
+
+def _clip(x: float):
+    if x < 0.0:
+        return 0.0
+    return 1.0
+
+def check(n: int):
+    if n < 0:
+        raise ValueError(n)
+    return 0
+
+def _sign(n: int):
+    if n < 0:
+        return -1
+    return 1
+
+class P:
+    def __init__(self, x: float, y: float):
+        self.x = x
+        self.y = y
+
+    def _inside(self):
+        if self.x < 0.0:
+            return 0
+        return 1
+
+    def area(self):
+        return self.x * self.y * _scale * _N
+
+def points(n: int):
+    return [P(1.0 * i, 2.0) for i in range(n)]
+"""
+
+round_opts = PX.PXOptions(cdef=True, final=True)
+
+def valid(out):
+    """
+    Every declaration of out is read back, with a known type
+    """
+    mdl = PX.readModule(out)
+    clss = [i for i in mdl.items if isinstance(i, PX.PXClass)]
+    nread = len(mdl.glbls) + len(mdl.items) + sum(len(c.meths) + len(c.attrs) for c in clss)
+    ndecl = len([l for l in out.splitlines() if l.split(' ')[0] in ['cdef', 'cpdef'] or
+                 l.lstrip().split(' ')[0] in ['cdef', 'cpdef'] and l[:1] == ' '])
+    assert nread == ndecl, (nread, ndecl)
+    names = {c.name for c in clss}
+    for f in mdl.functions():
+        for t in [f.type] + [a.type for a in f.args.values()]:
+            assert t == '' or pxtype.isKnown(t) or t in names, (f.name, t)
+    return mdl
+
+def test_round_trip_module():
+    out = body(remerge(round_src, None, round_opts))
+    for decl in ['cdef long         _N               # constant: 10',
+                 'cdef double       _scale',
+                 'cpdef              set_scale       (double s)',
+                 'cdef  double       _clip           (double x) noexcept',
+                 'cpdef long         check           (long n) except -1',
+                 'cdef  long         _sign           (long n) noexcept',
+                 '@cython.freelist(8)\n@cython.final\ncdef class P:',
+                 '    cdef  long         _inside         (P self) noexcept',
+                 '    cpdef object       area            (P self)']:
+        assert decl in out, decl
+    mdl = valid(out)
+    assert [i.final for i in mdl.items if isinstance(i, PX.PXClass)] == [True]
+    # ---  Merging the output again leaves it unchanged
+    assert body(remerge(round_src, out, round_opts)) == out
+
+def test_item_cache_is_full_build():
+    pxd = remerge(round_src, None, round_opts)
+    # ---  A hand edit of the pxd is merged by both
+    pxd = pxd.replace('(long n) noexcept', '(Py_ssize_t n) noexcept')
+    full = body(remerge(round_src, pxd, round_opts))
+    assert '(Py_ssize_t n) noexcept' in full
+    cache = PX.PXItemCache()
+    for _ in range(2):  # cold then warm cache
+        mdl = PX.buildModule(round_src, opts=round_opts, cache=cache)
+        PX.mergeModule(mdl, pxd)
+        assert body(PX.renderModule(mdl)) == full
+    assert cache.hits
+
+def test_own_classes_are_typed():
+    src = ('class Local:\n    pass\n\n'
+           'def use(l: Local):\n    p = Local()\n    return 0\n')
+    out = body(PX.renderModule(PX.buildModule(src)))
+    assert '(Local l)' in out
+    assert '@cython.locals (p = Local)' in out
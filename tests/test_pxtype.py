@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Join table of the type lattice
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from py2pxd_ import pxtype
+
+join_table = [
+    ('long',              'size_t',             'size_t'),
+    ('long',              'unsigned long',      'long long'),
+    ('int',               'size_t',             'long long'),
+    ('long',              'unsigned long long', 'long long'),
+    ('unsigned int',      'unsigned long',      'unsigned long'),
+    ('unsigned long',     'size_t',             'size_t'),
+    ('int',               'unsigned int',       'long'),
+    ('int',               'float',              'double'),
+    ('bint',              'long',               'long'),
+    ('Py_ssize_t',        'size_t',             'long long'),
+    ('Py_ssize_t',        'unsigned long',      'long long'),
+    ('long long',         'unsigned long long', 'long long'),
+    ('unsigned long long','double',             'double'),
+    ('double[::1]',       'double[:]',          'double[:]'),
+    ('',                  'long',               'long'),
+    ('list',              'dict',               'object'),
+]
+
+def test_join_table():
+    for t1, t2, t in join_table:
+        assert pxtype.join(t1, t2) == t, (t1, t2)
+        assert pxtype.join(t2, t1) == t, (t2, t1)
+
+def test_join_mixed_sign_is_signed():
+    signed = ['signed char', 'short', 'int', 'long', 'Py_ssize_t', 'long long']
+    unsigned = ['unsigned short', 'unsigned int', 'unsigned long', 'size_t',
+                'unsigned long long']
+    for t1 in signed:
+        for t2 in unsigned:
+            if (t1, t2) in pxtype.type_overrides: continue
+            assert pxtype.join(t1, t2) in signed, (t1, t2)
+
+def test_join_integers_stay_integral():
+    for t1 in pxtype.int_types:
+        for t2 in pxtype.int_types:
+            assert pxtype.isInteger(pxtype.join(t1, t2)), (t1, t2)